@@ -1,4 +1,6 @@
 import os
+import uuid
+from collections import OrderedDict
 from pprint import pprint
 
 import chainlit as cl
@@ -7,7 +9,7 @@ from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langchain_core.tools import tool
 
 from steps import respond_to_user_message
-from search_engine import search_knowledge_base
+from search_engine import SearchResults
 import logging
     
 @cl.oauth_callback
@@ -77,14 +79,55 @@ async def on_chat_resume(thread: ThreadDict):
     await cl.context.emitter.set_commands(commands)
 
 
+SEARCH_PAGE_SIZE = 10
+# searches kept per session for paging; older ones are re-run when their button is clicked
+MAX_PAGED_SEARCHES = 5
+
+async def send_search_page(results: SearchResults, offset: int, search_id: str | None = None):
+    """
+    Send one page of command search results, with a button to fetch the next page if there is one.
+    The last MAX_PAGED_SEARCHES searches being paged through are kept in the session
+    under a per-search id, so every message's button pages through its own query.
+    """
+    content = results.format_page(offset, SEARCH_PAGE_SIZE)
+    if offset == 0:
+        content = f"Found {len(results)} matching documents\n{content}"
+
+    searches = cl.user_session.get("search_results") or OrderedDict()
+    search_id = search_id or uuid.uuid4().hex
+    actions = []
+    next_offset = offset + SEARCH_PAGE_SIZE
+    if next_offset < len(results):
+        searches[search_id] = results
+        searches.move_to_end(search_id)
+        while len(searches) > MAX_PAGED_SEARCHES:
+            searches.popitem(last=False)
+        actions.append(cl.Action(
+            name="show_more_results",
+            payload={"search_id": search_id, "query": results.query, "exact": results.exact, "offset": next_offset},
+            label=f"Show more ({len(results) - next_offset} remaining)",
+        ))
+    else:
+        searches.pop(search_id, None)
+    cl.user_session.set("search_results", searches)
+    await cl.Message(content=content, tags=["command_output"], actions=actions).send()
+
+@cl.action_callback("show_more_results")
+async def on_show_more_results(action: cl.Action):
+    await action.remove()
+    payload = action.payload
+    results = (cl.user_session.get("search_results") or {}).get(payload["search_id"])
+    if results is None:
+        # evicted by newer searches, or the session was resumed: run the search again
+        results = SearchResults(payload["query"], exact=payload["exact"])
+    await send_search_page(results, payload["offset"], payload["search_id"])
+
 @cl.on_message
 async def on_message(message: cl.Message):
     if message.command == "Fuzzy Search":
-        search_results = search_knowledge_base(message.content, exact=False)
-        await cl.Message(content=search_results, tags=["command_output"]).send()
+        await send_search_page(SearchResults(message.content, exact=False), 0)
     elif message.command == "Exact Search":
-        search_results = search_knowledge_base(message.content, exact=True)
-        await cl.Message(content=search_results, tags=["command_output"]).send()
+        await send_search_page(SearchResults(message.content, exact=True), 0)
     else:
         messages = cl.user_session.get("messages")
 
@@ -0,0 +1,114 @@
+import re
+from langchain_core.documents import Document
+from retrievers import get_doc_id
+
+PAGE_DELIMITER = "------- PAGE END -------"
+# text-embedding-3-large accepts at most 8191 tokens; smaller chunks are also cheaper to contextualize
+CHUNK_MAX_TOKENS = 4000
+CHUNK_OVERLAP_TOKENS = 200
+# articles below this size were always ingested whole; chunking them would change their ids
+CHUNK_MIN_ARTICLE_TOKENS = 9000
+
+def get_tokenizer():
+    from tiktoken import get_encoding
+    return get_encoding("cl100k_base")
+
+def split_segments(text: str) -> list[tuple[str, int]]:
+    """Split an article into (paragraph, page offset) segments, never crossing a page end."""
+    segments = []
+    for page_offset, page in enumerate(text.split(PAGE_DELIMITER)):
+        for paragraph in re.split(r'\n\s*\n', page):
+            if paragraph.strip():
+                segments.append((paragraph.strip('\n'), page_offset))
+    return segments
+
+def split_long_segment(text: str, tokens: list, max_tokens: int, tokenizer) -> list[tuple[str, int]]:
+    """Split a paragraph longer than max_tokens on line ends, or into token windows if a single line is too long."""
+    lines = text.split('\n')
+    if len(lines) > 1:
+        pieces = []
+        for line, line_tokens in zip(lines, tokenizer.encode_batch(lines)):
+            if len(line_tokens) > max_tokens:
+                pieces.extend(split_long_segment(line, line_tokens, max_tokens, tokenizer))
+            elif line.strip():
+                pieces.append((line, len(line_tokens)))
+        return pieces
+    return [
+        (tokenizer.decode(tokens[start:start + max_tokens]), len(tokens[start:start + max_tokens]))
+        for start in range(0, len(tokens), max_tokens)
+    ]
+
+def pack_segments(segments: list[tuple[str, int, int]], max_tokens: int, overlap_tokens: int) -> list[list[tuple[str, int, int]]]:
+    """
+    Greedily group (text, page offset, token count) segments into chunks of at
+    most max_tokens. Each chunk after the first starts with the trailing
+    segments of the previous one, up to overlap_tokens of them.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for segment in segments:
+        if current and current_tokens + segment[2] > max_tokens:
+            chunks.append(current)
+            overlap, overlap_size = [], 0
+            for previous in reversed(current):
+                if overlap_size + previous[2] > overlap_tokens or overlap_size + previous[2] + segment[2] > max_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += previous[2]
+            current, current_tokens = overlap, overlap_size
+        current.append(segment)
+        current_tokens += segment[2]
+    if current:
+        chunks.append(current)
+    return chunks
+
+def chunk_documents(docs: list[Document], tokenizer=None, max_tokens: int = CHUNK_MAX_TOKENS,
+                    overlap_tokens: int = CHUNK_OVERLAP_TOKENS, min_article_tokens: int = CHUNK_MIN_ARTICLE_TOKENS) -> list[Document]:
+    """
+    Split articles of at least min_article_tokens into chunk Documents of at
+    most max_tokens at paragraph and page boundaries, with about
+    overlap_tokens of overlap between neighbours. Shorter articles are
+    returned unchanged. Chunks keep the article's metadata and add parent_id,
+    chunk_index, chunk_count and their own start_page/end_page. Articles, and
+    then the paragraphs of long ones, are tokenized in one batched call each.
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    article_tokens = tokenizer.encode_batch([doc.page_content for doc in docs])
+    doc_segments = [
+        split_segments(doc.page_content) if len(tokens) >= min_article_tokens else None
+        for doc, tokens in zip(docs, article_tokens)
+    ]
+    flat = [text for segments in doc_segments if segments is not None for text, _ in segments]
+    token_lists = iter(tokenizer.encode_batch(flat) if flat else [])
+
+    chunked = []
+    for doc, segments in zip(docs, doc_segments):
+        if segments is None:
+            chunked.append(doc)
+            continue
+        sized = []
+        for text, page_offset in segments:
+            tokens = next(token_lists)
+            if len(tokens) > max_tokens:
+                sized.extend((piece, page_offset, size) for piece, size in split_long_segment(text, tokens, max_tokens, tokenizer))
+            else:
+                sized.append((text, page_offset, len(tokens)))
+
+        if sum(size for _, _, size in sized) <= max_tokens:
+            chunked.append(doc)
+            continue
+
+        chunks = pack_segments(sized, max_tokens, overlap_tokens)
+        start_page = doc.metadata.get('start_page')
+        for chunk_index, chunk in enumerate(chunks):
+            metadata = dict(doc.metadata)
+            metadata.update({
+                'parent_id': get_doc_id(doc),
+                'chunk_index': chunk_index,
+                'chunk_count': len(chunks),
+            })
+            if isinstance(start_page, int):
+                metadata['start_page'] = start_page + chunk[0][1]
+                metadata['end_page'] = start_page + chunk[-1][1]
+            chunked.append(Document(page_content='\n\n'.join(text for text, _, _ in chunk), metadata=metadata))
+    return chunked
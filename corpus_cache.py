@@ -0,0 +1,73 @@
+import hashlib
+import logging
+import os
+import threading
+from langchain_core.documents import Document
+from retrievers import load_docs_from_jsonl
+
+class Corpus:
+    """
+    An in-memory snapshot of the knowledge base.
+    Keeps the lowercased content and token list of every document alongside
+    the Documents so searches never have to re-normalize the text.
+    """
+
+    def __init__(self, documents: list[Document], version: str):
+        self.documents = documents
+        self.version = version
+        self.contents = [doc.page_content.lower() for doc in documents]
+        self.tokens = [content.split() for content in self.contents]
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+def file_hash(file_path: str) -> str:
+    """Return the sha256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class CorpusCache:
+    """
+    Process-wide cache of Corpus snapshots keyed by file path.
+    A cached corpus is reused until the file's mtime or size changes; the file
+    is then re-hashed and only reloaded if its content actually differs.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, tuple[tuple[int, int], Corpus]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str) -> Corpus:
+        stat = os.stat(file_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._entries.get(file_path)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+
+            version = file_hash(file_path)
+            if entry is not None and entry[1].version == version:
+                corpus = entry[1]
+            else:
+                logging.info(f"loading corpus from {file_path}")
+                corpus = Corpus(load_docs_from_jsonl(file_path), version)
+            self._entries[file_path] = (signature, corpus)
+            return corpus
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+corpus_cache = CorpusCache()
+
+def get_corpus(file_path: str = "knowledge_base.jsonl") -> Corpus:
+    """Return the cached corpus for file_path, reloading it if the file changed."""
+    return corpus_cache.get(file_path)
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that stores every vector in a SQLite file keyed by the
+    sha256 of the embedded text, so repeated texts and queries are only sent
+    to the underlying model once. Vectors are stored as float32.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: str, namespace: str | None = None):
+        self.embeddings = embeddings
+        self.path = path
+        # vectors of different models must not mix
+        self.namespace = namespace if namespace is not None else str(getattr(embeddings, 'model', type(embeddings).__name__))
+        # some models embed queries differently from documents
+        self.query_namespace = f"{self.namespace}:query"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(namespace TEXT, hash TEXT, vector BLOB, PRIMARY KEY (namespace, hash))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _lookup(self, namespace: str, hashes: list[str]) -> dict[str, list[float]]:
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._connect() as db:
+            # stay below SQLite's bound parameter limit
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = db.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE namespace = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [namespace, *batch],
+                ).fetchall()
+                for text_id, vector in rows:
+                    found[text_id] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, namespace: str, hashes: list[str], vectors: list[list[float]]) -> dict[str, list[float]]:
+        stored = {}
+        rows = []
+        for text_id, vector in zip(hashes, vectors):
+            array = np.asarray(vector, dtype=np.float32)
+            stored[text_id] = array.tolist()
+            rows.append((namespace, text_id, array.tobytes()))
+        try:
+            with self._connect() as db:
+                db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logging.warning(f"embedding cache write failed: {e}")
+        return stored
+
+    def _split(self, namespace: str, texts: list[str]) -> tuple[list[str], dict[str, list[float]], dict[str, str]]:
+        hashes = [text_hash(text) for text in texts]
+        found = self._lookup(namespace, hashes)
+        missing = {}
+        for text, text_id in zip(texts, hashes):
+            if text_id not in found:
+                missing.setdefault(text_id, text)
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return hashes, found, missing
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes, found, missing = self._split(self.namespace, texts)
+        if missing:
+            found.update(self._store(self.namespace, list(missing), self.embeddings.embed_documents(list(missing.values()))))
+        return [found[text_id] for text_id in hashes]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        # SQLite reads and writes run in a worker thread to keep the event loop free
+        hashes, found, missing = await asyncio.to_thread(self._split, self.namespace, texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            found.update(await asyncio.to_thread(self._store, self.namespace, list(missing), vectors))
+        return [found[text_id] for text_id in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        hashes, found, missing = self._split(self.query_namespace, [text])
+        if missing:
+            found.update(self._store(self.query_namespace, hashes, [self.embeddings.embed_query(text)]))
+        return found[hashes[0]]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        hashes, found, missing = await asyncio.to_thread(self._split, self.query_namespace, [text])
+        if missing:
+            vector = await self.embeddings.aembed_query(text)
+            found.update(await asyncio.to_thread(self._store, self.query_namespace, hashes, [vector]))
+        return found[hashes[0]]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
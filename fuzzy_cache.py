@@ -0,0 +1,316 @@
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+from langchain_core.documents import Document
+
+# bump when the on-disk layout or the cached values change
+CACHE_FORMAT_VERSION = 3
+
+def documents_hash(documents: list[Document]) -> str:
+    """Return a sha256 hex digest identifying the content and metadata of documents."""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(doc.page_content.encode('utf-8'))
+        digest.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+class PostingsTable:
+    """
+    Read-only inverted index stored as CSR arrays: the postings of keys[i] are
+    postings[offsets[i]:offsets[i + 1]]. Saved tables are loaded memory-mapped.
+    """
+
+    def __init__(self, keys: list[str], offsets: np.ndarray, postings: np.ndarray):
+        self.keys = keys
+        self.offsets = offsets
+        self.postings = postings
+        self._rows = {key: row for row, key in enumerate(keys)}
+
+    @classmethod
+    def from_dict(cls, table: dict[str, list[int]]) -> "PostingsTable":
+        keys = list(table)
+        lengths = np.fromiter((len(table[key]) for key in keys), dtype=np.int64, count=len(keys))
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        postings = np.fromiter(
+            (doc_id for key in keys for doc_id in table[key]),
+            dtype=np.int32, count=int(offsets[-1]),
+        )
+        return cls(keys, offsets, postings)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        row = self._rows[key]
+        return self.postings[self.offsets[row]:self.offsets[row + 1]]
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.postings.nbytes + python_size(self.keys)
+
+    def get(self, key: str, default=None):
+        row = self._rows.get(key)
+        if row is None:
+            return default
+        return self.postings[self.offsets[row]:self.offsets[row + 1]]
+
+    def save(self, directory: str, name: str) -> None:
+        # keys never contain whitespace (they come from str.split), so one per line is safe
+        with open(os.path.join(directory, f"{name}_keys.txt"), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.keys))
+        np.save(os.path.join(directory, f"{name}_offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, f"{name}_postings.npy"), self.postings)
+
+    @classmethod
+    def load(cls, directory: str, name: str) -> "PostingsTable":
+        with open(os.path.join(directory, f"{name}_keys.txt"), encoding='utf-8') as f:
+            text = f.read()
+        keys = text.split('\n') if text else []
+        offsets = np.load(os.path.join(directory, f"{name}_offsets.npy"), mmap_mode='r')
+        postings = np.load(os.path.join(directory, f"{name}_postings.npy"), mmap_mode='r')
+        return cls(keys, offsets, postings)
+
+class StringColumn:
+    """
+    A list of strings stored as one UTF-8 buffer plus byte offsets.
+    Strings are decoded on access, so a memory-mapped column costs no RAM until used.
+    """
+
+    def __init__(self, buffer, offsets: np.ndarray):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: list[str]) -> "StringColumn":
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return cls(b''.join(encoded), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.buffer) + self.offsets.nbytes
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.buffer[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def save(self, directory: str, name: str) -> None:
+        with open(os.path.join(directory, f"{name}.bin"), 'wb') as f:
+            f.write(self.buffer)
+        np.save(os.path.join(directory, f"{name}_offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, directory: str, name: str) -> "StringColumn":
+        offsets = np.load(os.path.join(directory, f"{name}_offsets.npy"), mmap_mode='r')
+        with open(os.path.join(directory, f"{name}.bin"), 'rb') as f:
+            # mmap refuses empty files
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b''
+        return cls(buffer, offsets)
+
+class MetadataColumn:
+    """
+    The metadata values of every document as flat columns: the fields of
+    document i are the entries offsets[i]:offsets[i + 1], with field names
+    interned as ids into fields.
+    """
+
+    def __init__(self, fields: list[str], offsets: np.ndarray, field_ids: np.ndarray,
+                 values: StringColumn, phonetics: StringColumn):
+        self.fields = fields
+        self.offsets = offsets
+        self.field_ids = field_ids
+        self.values = values
+        self.phonetics = phonetics
+
+    @classmethod
+    def from_dicts(cls, metadata: list[dict[str, str]], metadata_phonetic: list[dict[str, str]]) -> "MetadataColumn":
+        fields = list(dict.fromkeys(field for values in metadata for field in values))
+        field_rows = {field: row for row, field in enumerate(fields)}
+        offsets = np.zeros(len(metadata) + 1, dtype=np.int64)
+        np.cumsum([len(values) for values in metadata], out=offsets[1:])
+        field_ids = np.array([field_rows[field] for values in metadata for field in values], dtype=np.int8)
+        return cls(
+            fields, offsets, field_ids,
+            StringColumn.from_strings([value for values in metadata for value in values.values()]),
+            StringColumn.from_strings([
+                phonetic[field] for values, phonetic in zip(metadata, metadata_phonetic) for field in values
+            ]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def entries(self, i: int) -> range:
+        return range(self.offsets[i], self.offsets[i + 1])
+
+    def __getitem__(self, i: int) -> dict[str, str]:
+        return {self.fields[self.field_ids[j]]: self.values[j] for j in self.entries(i)}
+
+    def phonetic(self, i: int) -> dict[str, str]:
+        return {self.fields[self.field_ids[j]]: self.phonetics[j] for j in self.entries(i)}
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.field_ids.nbytes + self.values.nbytes + self.phonetics.nbytes
+
+    def save(self, directory: str, name: str) -> None:
+        with open(os.path.join(directory, f"{name}_fields.txt"), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.fields))
+        np.save(os.path.join(directory, f"{name}_offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, f"{name}_field_ids.npy"), self.field_ids)
+        self.values.save(directory, f"{name}_values")
+        self.phonetics.save(directory, f"{name}_phonetics")
+
+    @classmethod
+    def load(cls, directory: str, name: str) -> "MetadataColumn":
+        with open(os.path.join(directory, f"{name}_fields.txt"), encoding='utf-8') as f:
+            text = f.read()
+        return cls(
+            text.split('\n') if text else [],
+            np.load(os.path.join(directory, f"{name}_offsets.npy"), mmap_mode='r'),
+            np.load(os.path.join(directory, f"{name}_field_ids.npy"), mmap_mode='r'),
+            StringColumn.load(directory, f"{name}_values"),
+            StringColumn.load(directory, f"{name}_phonetics"),
+        )
+
+class DocRecord:
+    """The pre-processed view of one document, as handed out by DocCache."""
+
+    __slots__ = ('document', 'content', 'content_phonetic', 'metadata', 'metadata_phonetic')
+
+    def __init__(self, document: Document, content: str, content_phonetic: str,
+                 metadata: dict[str, str], metadata_phonetic: dict[str, str]):
+        self.document = document
+        self.content = content
+        self.content_phonetic = content_phonetic
+        self.metadata = metadata
+        self.metadata_phonetic = metadata_phonetic
+
+class DocCache:
+    """
+    FuzzyMatchRetriever's per-document cache, stored by column.
+    Lowercased contents and phonetic codes each live in one shared buffer
+    (in memory, or memory-mapped when loaded from disk) and are only decoded
+    for the documents that are actually scored.
+    """
+
+    def __init__(self, documents: list[Document], contents: StringColumn, phonetics: StringColumn,
+                 metadata: MetadataColumn):
+        self.documents = documents
+        self.contents = contents
+        self.phonetics = phonetics
+        self.metadata = metadata
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def __getitem__(self, i: int) -> DocRecord:
+        return DocRecord(self.documents[i], self.contents[i], self.phonetics[i],
+                         self.metadata[i], self.metadata.phonetic(i))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def memory_usage(self) -> dict[str, int]:
+        """Approximate bytes held by each column, excluding the Documents themselves."""
+        return {
+            'contents': self.contents.nbytes,
+            'phonetics': self.phonetics.nbytes,
+            'metadata': self.metadata.nbytes,
+        }
+
+def python_size(value) -> int:
+    """Approximate deep size of nested lists/dicts of strings."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(python_size(key) + python_size(item) for key, item in value.items())
+    elif isinstance(value, list):
+        size += sum(python_size(item) for item in value)
+    return size
+
+TABLES = ('content_tokens', 'metadata_tokens', 'phonetic', 'ngrams')
+
+def save_fuzzy_cache(path: str, doc_cache: DocCache, tables: dict[str, PostingsTable], vocabulary: list[str],
+                     phonetic_codes: dict[str, str]) -> None:
+    """
+    Write a retriever's document cache and candidate indexes to the directory path.
+    The directory is written under a temporary name and renamed into place, so
+    concurrent workers either see a complete cache or none.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        doc_cache.contents.save(tmp_dir, 'contents')
+        doc_cache.phonetics.save(tmp_dir, 'content_phonetics')
+        doc_cache.metadata.save(tmp_dir, 'metadata')
+        with open(os.path.join(tmp_dir, 'header.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_FORMAT_VERSION, 'doc_count': len(doc_cache)}, f)
+        with open(os.path.join(tmp_dir, 'vocabulary.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(vocabulary))
+        with open(os.path.join(tmp_dir, 'phonetic_codes.json'), 'w', encoding='utf-8') as f:
+            json.dump(phonetic_codes, f)
+        for name in TABLES:
+            tables[name].save(tmp_dir, name)
+        os.replace(tmp_dir, path)
+    except OSError as e:
+        # another worker may have renamed its copy into place first
+        logging.info(f"not saving fuzzy cache to {path}: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    prune_fuzzy_caches(path)
+
+def prune_fuzzy_caches(path: str) -> None:
+    """
+    Remove the caches of other corpus versions next to path, so every
+    knowledge base update does not leave another copy of the corpus on disk.
+    Workers still mapping a removed cache keep reading it until they reload.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    for stale in glob.glob(os.path.join(parent, f"*-v{CACHE_FORMAT_VERSION}")):
+        if os.path.abspath(stale) != os.path.abspath(path) and os.path.isdir(stale):
+            logging.info(f"removing stale fuzzy cache {stale}")
+            shutil.rmtree(stale, ignore_errors=True)
+
+def load_fuzzy_cache(path: str, documents: list[Document]):
+    """
+    Load a cache written by save_fuzzy_cache for the given documents.
+    Returns (doc_cache, tables, vocabulary, phonetic_codes), or None if there is no usable cache at path.
+    """
+    if not os.path.exists(os.path.join(path, 'header.json')):
+        return None
+    try:
+        with open(os.path.join(path, 'header.json'), encoding='utf-8') as f:
+            header = json.load(f)
+        if header.get('version') != CACHE_FORMAT_VERSION or header.get('doc_count') != len(documents):
+            return None
+        doc_cache = DocCache(
+            documents,
+            StringColumn.load(path, 'contents'),
+            StringColumn.load(path, 'content_phonetics'),
+            MetadataColumn.load(path, 'metadata'),
+        )
+        with open(os.path.join(path, 'vocabulary.txt'), encoding='utf-8') as f:
+            text = f.read()
+        vocabulary = text.split('\n') if text else []
+        with open(os.path.join(path, 'phonetic_codes.json'), encoding='utf-8') as f:
+            phonetic_codes = json.load(f)
+        tables = {name: PostingsTable.load(path, name) for name in TABLES}
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"ignoring unreadable fuzzy cache at {path}: {e}")
+        return None
+    return doc_cache, tables, vocabulary, phonetic_codes
@@ -15,8 +15,9 @@ from glob import glob
 import dotenv
 from tqdm import tqdm, trange
 import logging
-from tiktoken import get_encoding
-from retrievers import save_doc_to_json, load_doc_from_json, save_docs_to_jsonl, load_docs_from_jsonl, add_to_vector_store, get_doc_id
+from chunking import chunk_documents
+from knowledge_base import KnowledgeBaseStore
+from retrievers import save_doc_to_json, load_doc_from_json, save_docs_to_jsonl, load_docs_from_jsonl, sync_vector_store, get_doc_id
 
 dotenv.load_dotenv()
 
@@ -112,8 +113,9 @@ INSTRUCTIONS:
     return article_boundaries
 
 def filter_existing_docs(paths:list[str], knowledge_base_path:str)->list[str]:
-    existing_docs = load_docs_from_jsonl(knowledge_base_path)
-    existing_filenames = {os.path.basename(doc.metadata.get('source')) for doc in existing_docs}
+    # the sidecar index knows every source without parsing the knowledge base
+    sources = KnowledgeBaseStore(knowledge_base_path, key=get_doc_id).sources()
+    existing_filenames = {os.path.basename(source) for source in sources}
     return [path for path in paths if os.path.basename(path) not in existing_filenames]
 
 def save_pdf_text_if_not_exists(path):
@@ -166,15 +168,14 @@ async def main():
     # move articles to knowledge base
     article_paths = glob("documents/articles/*.json")
     articles = [load_doc_from_json(path) for path in article_paths]
-    encoding = get_encoding("cl100k_base")
-    articles = [article for article in articles if len(encoding.encode(article.page_content)) < 9000]
+    # split long articles instead of dropping them
+    articles = chunk_documents(articles)
     save_docs_to_jsonl(articles, knowledge_base_path)
 
-    # add articles to vector store
-    batch_size = 100
-    for i in trange(0, len(articles), batch_size):
-        batch = articles[i:i+batch_size]
-        add_to_vector_store(batch)
+    # add new and changed articles to the vector store and remove the ones re-parsing dropped from their issues
+    deleted_ids = sync_vector_store(articles, delete_missing=True)
+    # drop the same articles from the knowledge base, so the search commands stop returning them
+    KnowledgeBaseStore(knowledge_base_path, key=get_doc_id).delete(deleted_ids)
     
 
 if __name__ == "__main__":
@@ -0,0 +1,339 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+import orjson
+from langchain_core.documents import Document
+
+SIDECAR_VERSION = 2
+# bytes at each end of the indexed range that the sidecar fingerprints
+FINGERPRINT_BYTES = 4096
+
+# a record {"deleted": doc_id} removes the document with that id
+TOMBSTONE_KEY = 'deleted'
+
+def read_records(file_path: str, start: int = 0, end: int | None = None) -> Iterator[tuple[int, int, dict]]:
+    """
+    Yield (offset, length, record) for every complete line of a JSONL file,
+    optionally only for the lines between the byte offsets start and end.
+    A trailing line without a newline that does not parse is a record still
+    being written and is skipped.
+    """
+    offset = start
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            if end is not None and offset >= end:
+                break
+            length = len(line)
+            if line.strip():
+                try:
+                    yield offset, length, orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    if line.endswith(b'\n'):
+                        raise
+                    logging.warning(f"ignoring incomplete last record in {file_path}")
+            offset += length
+
+class KnowledgeBaseStore:
+    """
+    The knowledge base as an append-only log of JSONL records.
+    New and updated documents are appended, and the last record of a document
+    id wins, so adding a magazine issue never rewrites the archive. Documents
+    keep the position of their first record. Superseded records are dropped by
+    compaction, which writes a new file and atomically renames it over the old
+    one, so readers always see a complete file.
+    Deleting a document appends a tombstone record, which compaction drops
+    together with the records it deletes.
+    The id -> (offset, length) index is kept in a sidecar file next to the
+    knowledge base, so looking up a document is a seek instead of a parse of
+    the whole archive; records appended since the sidecar was written are
+    indexed incrementally.
+    """
+
+    def __init__(self, path: str, key: Callable[[Document], str], compact_ratio: float = 0.5):
+        self.path = path
+        self.key = key
+        # compact once superseded records make up this share of the file
+        self.compact_ratio = compact_ratio
+        self.sidecar_path = f"{path}.idx"
+        self._index: dict[str, tuple[int, int]] = {}
+        self._sources: dict[str, list[str]] = {}
+        self._records = 0
+        self._signature = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers across threads and processes."""
+        with self._lock, open(f"{self.path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _add(self, doc_id: str, offset: int, length: int, source: str | None) -> None:
+        if doc_id not in self._index:
+            self._sources.setdefault(source, []).append(doc_id)
+        self._index[doc_id] = (offset, length)
+
+    def _remove(self, doc_id: str) -> None:
+        if self._index.pop(doc_id, None) is None:
+            return
+        for doc_ids in self._sources.values():
+            if doc_id in doc_ids:
+                doc_ids.remove(doc_id)
+                break
+
+    def _refresh(self) -> None:
+        """Bring the index up to date with the file, starting from the sidecar when it is usable."""
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        self._index, self._sources, self._records = {}, {}, 0
+        if signature is not None:
+            indexed_size = self._read_sidecar(signature)
+            scanned_size = indexed_size
+            for offset, length, record in read_records(self.path, indexed_size, signature[1]):
+                if TOMBSTONE_KEY in record:
+                    self._remove(record[TOMBSTONE_KEY])
+                else:
+                    doc = Document(**record)
+                    self._add(self.key(doc), offset, length, doc.metadata.get('source'))
+                self._records += 1
+                scanned_size = offset + length
+            if scanned_size != indexed_size:
+                self._write_sidecar(signature[0], scanned_size)
+        self._signature = signature
+
+    def _read_sidecar(self, signature) -> int:
+        """Load the sidecar index if it belongs to this file. Returns the number of bytes it covers."""
+        try:
+            with open(self.sidecar_path, 'rb') as f:
+                sidecar = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return 0
+        if sidecar.get('version') != SIDECAR_VERSION or sidecar.get('inode') != signature[0] or sidecar.get('size', 0) > signature[1]:
+            return 0
+        # a rewrite in place keeps the inode, but not the bytes the offsets point into
+        if sidecar['fingerprint'] != self._fingerprint(sidecar['size']):
+            logging.info(f"{self.path} was rewritten since {self.sidecar_path} was written, re-indexing")
+            return 0
+        for doc_id, offset, length, source in sidecar['docs']:
+            self._add(doc_id, offset, length, source)
+        self._records = sidecar['records']
+        return sidecar['size']
+
+    def _fingerprint(self, size: int) -> str:
+        """sha256 of the first and last FINGERPRINT_BYTES of the first size bytes of the file."""
+        digest = hashlib.sha256()
+        try:
+            with open(self.path, 'rb') as f:
+                digest.update(f.read(min(size, FINGERPRINT_BYTES)))
+                f.seek(max(0, size - FINGERPRINT_BYTES))
+                digest.update(f.read(size - f.tell()))
+        except OSError:
+            return ''
+        return digest.hexdigest()
+
+    def _write_sidecar(self, inode: int, size: int) -> None:
+        sources = {doc_id: source for source, doc_ids in self._sources.items() for doc_id in doc_ids}
+        sidecar = {
+            'version': SIDECAR_VERSION,
+            'inode': inode,
+            'size': size,
+            'fingerprint': self._fingerprint(size),
+            'records': self._records,
+            'docs': [[doc_id, offset, length, sources[doc_id]] for doc_id, (offset, length) in self._index.items()],
+        }
+        tmp_path = f"{self.sidecar_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(sidecar))
+            os.replace(tmp_path, self.sidecar_path)
+        except OSError as e:
+            logging.warning(f"could not write {self.sidecar_path}: {e}")
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._index)
+
+    def _truncate_partial_record(self, f) -> None:
+        """Drop an unterminated last line left behind by a crashed writer."""
+        size = f.seek(0, os.SEEK_END)
+        if not size:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+    def append(self, docs: list[Document]) -> int:
+        """Append the new and changed documents. Returns the number of records written."""
+        with self._locked():
+            self._refresh()
+            with open(self.path, 'a+b') as f:
+                self._truncate_partial_record(f)
+                offset = f.seek(0, os.SEEK_END)
+                lines = []
+                pending: dict[str, bytes] = {}
+                for doc in docs:
+                    line = (doc.model_dump_json() + '\n').encode('utf-8')
+                    doc_id = self.key(doc)
+                    if doc_id in pending:
+                        if pending[doc_id] == line:
+                            continue
+                    elif doc_id in self._index:
+                        existing_offset, existing_length = self._index[doc_id]
+                        f.seek(existing_offset)
+                        if existing_length == len(line) and f.read(existing_length) == line:
+                            continue
+                    pending[doc_id] = line
+                    lines.append(line)
+                    self._add(doc_id, offset, len(line), doc.metadata.get('source'))
+                    offset += len(line)
+                if lines:
+                    f.seek(0, os.SEEK_END)
+                    f.write(b''.join(lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._records += len(lines)
+            self._signature = self._file_signature()
+            if lines:
+                self._write_sidecar(self._signature[0], offset)
+        logging.info(f"appended {len(lines)} of {len(docs)} documents to {self.path}")
+        return len(lines)
+
+    def delete(self, doc_ids: list[str]) -> int:
+        """Delete documents by appending tombstones. Returns the number of documents deleted."""
+        with self._locked():
+            self._refresh()
+            doc_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id in self._index]
+            if doc_ids:
+                with open(self.path, 'a+b') as f:
+                    self._truncate_partial_record(f)
+                    f.seek(0, os.SEEK_END)
+                    f.write(b''.join(orjson.dumps({TOMBSTONE_KEY: doc_id}) + b'\n' for doc_id in doc_ids))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    size = f.tell()
+                for doc_id in doc_ids:
+                    self._remove(doc_id)
+                self._records += len(doc_ids)
+                self._signature = self._file_signature()
+                self._write_sidecar(self._signature[0], size)
+        logging.info(f"deleted {len(doc_ids)} documents from {self.path}")
+        return len(doc_ids)
+
+    def _open(self):
+        """Open the file the index describes, re-indexing if it was replaced by a compaction meanwhile."""
+        while True:
+            self._refresh()
+            f = open(self.path, 'rb')
+            if self._signature is not None and os.fstat(f.fileno()).st_ino == self._signature[0]:
+                return f
+            f.close()
+            self._signature = None
+
+    def __contains__(self, doc_id: str) -> bool:
+        self._refresh()
+        return doc_id in self._index
+
+    def get(self, doc_id: str) -> Document | None:
+        """The current version of a document, read with a single seek."""
+        with self._open() as f:
+            location = self._index.get(doc_id)
+            if location is None:
+                return None
+            f.seek(location[0])
+            return Document(**orjson.loads(f.read(location[1])))
+
+    def get_by_source(self, source: str) -> list[Document]:
+        """The documents parsed from the given source file."""
+        return [doc for doc in map(self.get, self._source_ids(source)) if doc is not None]
+
+    def _source_ids(self, source: str) -> list[str]:
+        self._refresh()
+        return list(self._sources.get(source, []))
+
+    def sources(self) -> set[str]:
+        self._refresh()
+        return {source for source in self._sources if source is not None}
+
+    def iter_documents(self) -> Iterator[Document]:
+        """Lazily yield the current version of every document from a memory map of the file."""
+        with self._open() as f:
+            locations = list(self._index.values())
+            if not locations:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset, length in locations:
+                    yield Document(**orjson.loads(mapped[offset:offset + length]))
+
+    def documents(self) -> list[Document]:
+        """The current version of every document."""
+        return list(self.iter_documents())
+
+    def needs_compaction(self) -> bool:
+        self._refresh()
+        return self._records > 0 and (self._records - len(self._index)) / self._records >= self.compact_ratio
+
+    def compact(self) -> None:
+        """Rewrite the file with only the current record of every document, dropping deleted ones and tombstones."""
+        with self._locked():
+            self._refresh()
+            if self._records == len(self._index):
+                return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.compact-')
+            try:
+                os.chmod(tmp_path, os.stat(self.path).st_mode)
+                index = {}
+                offset = 0
+                with open(self.path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+                    for doc_id, (record_offset, length) in self._index.items():
+                        source.seek(record_offset)
+                        target.write(source.read(length))
+                        index[doc_id] = (offset, length)
+                        offset += length
+                    target.flush()
+                    os.fsync(target.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            logging.info(f"compacted {self.path} from {self._records} to {len(index)} records")
+            self._index = index
+            self._records = len(index)
+            self._signature = self._file_signature()
+            self._write_sidecar(self._signature[0], offset)
+
+    def compact_in_background(self) -> threading.Thread | None:
+        """Start compacting in a thread if enough records are superseded."""
+        if not self.needs_compaction():
+            return None
+        thread = threading.Thread(target=self.compact, name="knowledge-base-compaction")
+        thread.start()
+        return thread
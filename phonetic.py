@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+from metaphone import doublemetaphone
+
+class PhoneticEncoder:
+    """
+    Memoized doublemetaphone primary codes.
+    Words of the corpus vocabulary are kept in an unbounded dictionary built
+    once; other words (typically from queries) go through a bounded LRU,
+    which is locked since retrievers encode queries from worker threads.
+    """
+
+    def __init__(self, vocabulary_codes: dict[str, str] | None = None, max_query_words: int = 10_000):
+        self.vocabulary_codes = dict(vocabulary_codes or {})
+        self.max_query_words = max_query_words
+        self._query_codes: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def learn(self, word: str) -> str:
+        """Return the code of a corpus word, computing it only the first time the word is seen."""
+        code = self.vocabulary_codes.get(word)
+        if code is None:
+            self.misses += 1
+            code = self.vocabulary_codes[word] = doublemetaphone(word)[0]
+        else:
+            self.hits += 1
+        return code
+
+    def encode(self, word: str) -> str:
+        """Return the code of a query word without growing the vocabulary dictionary."""
+        code = self.vocabulary_codes.get(word)
+        if code is not None:
+            self.hits += 1
+            return code
+        with self._lock:
+            code = self._query_codes.get(word)
+            if code is not None:
+                self.hits += 1
+                self._query_codes.move_to_end(word)
+                return code
+            self.misses += 1
+        code = doublemetaphone(word)[0]
+        with self._lock:
+            self._query_codes[word] = code
+            self._query_codes.move_to_end(word)
+            if len(self._query_codes) > self.max_query_words:
+                self._query_codes.popitem(last=False)
+        return code
+
+    def learn_text(self, text: str) -> str:
+        return ' '.join([self.learn(word) for word in text.split()])
+
+    def encode_text(self, text: str) -> str:
+        return ' '.join([self.encode(word) for word in text.split()])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'vocabulary_words': len(self.vocabulary_codes),
+            'query_words': len(self._query_codes),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from retriever_batch import abatch_with_callbacks, batch_with_callbacks
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace insensitive form of a query, used as its cache key."""
+    return ' '.join(query.lower().split())
+
+class QueryResultCache:
+    """
+    Bounded LRU cache of retrieval results with a time to live.
+    Entries can also be persisted to a SQLite file, so results survive
+    restarts and are shared by workers on the same box.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float | None = 24 * 3600, path: str | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries: OrderedDict[str, tuple[float, list[Document]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with self._connect() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, created REAL, docs TEXT)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str) -> list[Document] | None:
+        """Return copies of the cached documents for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is None and self.path is not None:
+                entry = self._load(key)
+                if entry is not None:
+                    self._insert(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # callers may edit the documents they get back
+        return [doc.model_copy() for doc in entry[1]]
+
+    def put(self, key: str, docs: list[Document]) -> None:
+        entry = (time.time(), [doc.model_copy() for doc in docs])
+        with self._lock:
+            self._insert(key, entry)
+            if self.path is not None:
+                self._store(key, entry)
+
+    def _insert(self, key: str, entry: tuple[float, list[Document]]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load(self, key: str) -> tuple[float, list[Document]] | None:
+        try:
+            with self._connect() as db:
+                row = db.execute("SELECT created, docs FROM results WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"query cache read failed: {e}")
+            return None
+        if row is None or self._expired(row[0]):
+            return None
+        return row[0], [Document(**data) for data in json.loads(row[1])]
+
+    def _store(self, key: str, entry: tuple[float, list[Document]]) -> None:
+        docs = json.dumps([doc.model_dump() for doc in entry[1]])
+        try:
+            with self._connect() as db:
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, entry[0], docs))
+                if self.ttl is not None:
+                    db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            logging.warning(f"query cache write failed: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self.path is not None:
+                with self._connect() as db:
+                    db.execute("DELETE FROM results")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+class CachedRetriever(BaseRetriever):
+    """
+    Serves repeated queries of the wrapped retriever from a QueryResultCache.
+    Queries are keyed on their normalized text and the corpus version, so
+    results are recomputed once the knowledge base changes.
+    """
+    retriever: BaseRetriever
+    cache: QueryResultCache
+    # e.g. the hash of knowledge_base.jsonl
+    corpus_version: str = ""
+
+    def _key(self, query: str) -> str:
+        return f"{self.corpus_version}\x00{normalize_query(query)}"
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        return self._retrieve([query], [{"callbacks": run_manager.get_child()}])[0]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        return (await self._aretrieve([query], [{"callbacks": run_manager.get_child()}]))[0]
+
+    def _lookup(self, inputs: list[str]) -> tuple[list[list[Document] | None], dict[str, int]]:
+        """
+        Cached results per input, and the position of the first input of each
+        distinct missing query. That input's own spelling is what gets retrieved,
+        since the normalized form would change the text that is embedded.
+        """
+        results = [self.cache.get(self._key(query)) for query in inputs]
+        missing = {}
+        for position, (query, docs) in enumerate(zip(inputs, results)):
+            if docs is None:
+                missing.setdefault(normalize_query(query), position)
+        return results, missing
+
+    def _fill(self, inputs: list[str], results: list, missing: dict[str, int], retrieved: list[list[Document]]) -> list[list[Document]]:
+        by_query = dict(zip(missing, retrieved))
+        for query, docs in by_query.items():
+            self.cache.put(self._key(query), docs)
+        return [
+            docs if docs is not None else [doc.model_copy() for doc in by_query[normalize_query(query)]]
+            for query, docs in zip(inputs, results)
+        ]
+
+    def _retrieve(self, queries: list[str], configs: list, **kwargs) -> list[list[Document]]:
+        results, missing = self._lookup(queries)
+        retrieved = self.retriever.batch(
+            [queries[position] for position in missing.values()], [configs[position] for position in missing.values()], **kwargs,
+        ) if missing else []
+        return self._fill(queries, results, missing, retrieved)
+
+    async def _aretrieve(self, queries: list[str], configs: list, **kwargs) -> list[list[Document]]:
+        # cache reads and writes may block on SQLite, so they stay off the event loop
+        results, missing = await asyncio.to_thread(self._lookup, queries)
+        retrieved = await self.retriever.abatch(
+            [queries[position] for position in missing.values()], [configs[position] for position in missing.values()], **kwargs,
+        ) if missing else []
+        return await asyncio.to_thread(self._fill, queries, results, missing, retrieved)
+
+    def batch(self, inputs: list[str], config=None, *, return_exceptions: bool = False, **kwargs) -> list[list[Document]]:
+        """Retrieve only the queries that are not cached, each distinct one once, tracing a run per query."""
+        inputs = list(inputs)
+        if not inputs:
+            return []
+        return batch_with_callbacks(
+            self, inputs, config, lambda queries, configs: self._retrieve(queries, configs, **kwargs), return_exceptions,
+        )
+
+    async def abatch(self, inputs: list[str], config=None, *, return_exceptions: bool = False, **kwargs) -> list[list[Document]]:
+        inputs = list(inputs)
+        if not inputs:
+            return []
+        return await abatch_with_callbacks(
+            self, inputs, config, lambda queries, configs: self._aretrieve(queries, configs, **kwargs), return_exceptions,
+        )
@@ -0,0 +1,534 @@
+import bisect
+from functools import cached_property
+import numpy as np
+from langchain_core.documents import Document
+from search_index import FIELDS, InvertedIndex, difference_postings, intersect_postings, tokenize_field, union_postings
+
+# above this many postings per document the plan is evaluated with bitsets
+BITSET_DENSITY = 0.25
+
+class NormalizedDocument:
+    """
+    A document's content lowercased once, with its token set and token
+    positions built on first use.
+    Every leaf of a query plan is evaluated against the same normalized copy.
+    """
+
+    def __init__(self, content: str, tokens: list[str] | None = None, metadata: dict | None = None):
+        self.content = content
+        self._tokens = tokens
+        self.metadata = metadata or {}
+        self._fields: dict[str, NormalizedDocument] = {}
+
+    @cached_property
+    def tokens(self) -> list[str]:
+        return self._tokens if self._tokens is not None else self.content.split()
+
+    @cached_property
+    def token_set(self) -> set[str]:
+        return set(self.tokens)
+
+    @cached_property
+    def token_positions(self) -> dict[str, list[int]]:
+        token_positions: dict[str, list[int]] = {}
+        for position, token in enumerate(self.tokens):
+            token_positions.setdefault(token, []).append(position)
+        return token_positions
+
+    def positions(self, word: str, exact: bool) -> list[int]:
+        """
+        Return the sorted positions of tokens equal to word (exact) or containing it.
+        """
+        if exact:
+            return self.token_positions.get(word, [])
+        return sorted(
+            position
+            for token, positions in self.token_positions.items() if word in token
+            for position in positions
+        )
+
+    def field(self, field: str) -> "NormalizedDocument":
+        """
+        Return a metadata field (a key of FIELDS) normalized like the field indexes.
+        """
+        normalized = self._fields.get(field)
+        if normalized is None:
+            tokens = tokenize_field(self.metadata.get(FIELDS[field]))
+            normalized = NormalizedDocument(' '.join(tokens), tokens)
+            self._fields[field] = normalized
+        return normalized
+
+def normalize_document(doc: Document) -> NormalizedDocument:
+    return NormalizedDocument(doc.page_content.lower(), metadata=doc.metadata)
+
+def phrase_starts(word_positions: list[list[int]]) -> list[int]:
+    """
+    Return the start positions where the i-th word occurs at start + i for every word.
+    """
+    if not word_positions:
+        return []
+    starts = set(word_positions[0])
+    for offset, positions in enumerate(word_positions[1:], 1):
+        starts &= {position - offset for position in positions}
+        if not starts:
+            break
+    return sorted(starts)
+
+def within_distance(left: list[int], left_length: int, right: list[int], right_length: int, distance: int) -> bool:
+    """
+    Check whether an occurrence in left and one in right (both sorted start
+    positions) are at most distance tokens apart, in either order.
+    """
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] <= right[j]:
+            if right[j] - (left[i] + left_length - 1) <= distance:
+                return True
+            i += 1
+        else:
+            if left[i] - (right[j] + right_length - 1) <= distance:
+                return True
+            j += 1
+    return False
+
+class PostingsNode:
+    """
+    Base class for plan nodes that resolve to a posting list of their own:
+    terms, phrases and proximity operators.
+    """
+
+    def __init__(self):
+        self._postings = None
+        self._mask = None
+
+    def estimate(self, index: InvertedIndex | None) -> float:
+        """
+        Estimated number of matching documents. Uses the index when available.
+        """
+        if index is not None:
+            return len(self.match_ids(index))
+        return self._static_estimate()
+
+    def order(self, index: InvertedIndex | None):
+        pass
+
+    def match_ids(self, index: InvertedIndex) -> list[int]:
+        if self._postings is None:
+            self._postings = self._resolve(index)
+        return self._postings
+
+    def posting_volume(self, index: InvertedIndex) -> int:
+        return len(self.match_ids(index))
+
+    def leaves(self) -> list:
+        return [self]
+
+    def contains(self, doc_id: int, index: InvertedIndex) -> bool:
+        postings = self.match_ids(index)
+        i = bisect.bisect_left(postings, doc_id)
+        return i < len(postings) and postings[i] == doc_id
+
+    def match_mask(self, index: InvertedIndex) -> np.ndarray:
+        if self._mask is None:
+            self._mask = np.zeros(index.doc_count, dtype=bool)
+            self._mask[self.match_ids(index)] = True
+        return self._mask
+
+class TermNode(PostingsNode):
+    """
+    Leaf of a query plan: a single lowercased term matched either as a whole
+    token (exact) or as a substring of the content.
+    """
+    length = 1
+
+    def __init__(self, term: str, exact: bool):
+        super().__init__()
+        self.term = term.lower()
+        self.exact = exact
+        self._tokens = None
+
+    @property
+    def key(self):
+        return ('TERM', self.term, self.exact)
+
+    def _static_estimate(self) -> float:
+        # without an index, assume longer terms are rarer
+        return 1.0 / (len(self.term) + 1)
+
+    def matches(self, doc: NormalizedDocument) -> bool:
+        if self.exact:
+            return self.term in doc.token_set
+        return self.term in doc.content
+
+    def doc_positions(self, doc: NormalizedDocument) -> list[int]:
+        return doc.positions(self.term, self.exact)
+
+    def tokens(self, index: InvertedIndex) -> list[str]:
+        """
+        The vocabulary tokens this term stands for.
+        """
+        if self._tokens is None:
+            self._tokens = [self.term] if self.exact else index.tokens_containing(self.term)
+        return self._tokens
+
+    def _resolve(self, index: InvertedIndex) -> list[int]:
+        if self.exact:
+            return index.lookup(self.term)
+        return union_postings([index.postings[token] for token in self.tokens(index)])
+
+    def positions(self, doc_id: int, index: InvertedIndex) -> list[int]:
+        """
+        Sorted token positions of this term in the document.
+        """
+        tokens = self.tokens(index)
+        if len(tokens) == 1:
+            return index.token_positions(tokens[0], doc_id)
+        return sorted(position for token in tokens for position in index.token_positions(token, doc_id))
+
+    def term_matches(self, index: InvertedIndex) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+        Return (doc ids, term frequencies, document frequency) for BM25 scoring.
+        A substring term counts the occurrences of every token that contains it.
+        """
+        doc_ids, freqs = index.term_matches(self.tokens(index))
+        return doc_ids, freqs, len(self.match_ids(index))
+
+class PhraseNode(PostingsNode):
+    """
+    A quoted phrase: its words must occur as consecutive tokens. Each word is
+    matched like a term, so in non-exact mode it may be part of a longer token.
+    Candidates come from intersecting the words' posting lists and are
+    verified with the positional index.
+    """
+
+    def __init__(self, words: list[str], exact: bool):
+        super().__init__()
+        self.words = [TermNode(word, exact) for word in words]
+        self.term = ' '.join(word.term for word in self.words)
+        self.exact = exact
+        self.length = len(self.words)
+        self._occurrences: dict[int, int] = {}
+
+    @property
+    def key(self):
+        return ('PHRASE', self.term, self.exact)
+
+    def _static_estimate(self) -> float:
+        return min(word._static_estimate() for word in self.words) / 2
+
+    def matches(self, doc: NormalizedDocument) -> bool:
+        return bool(self.doc_positions(doc))
+
+    def doc_positions(self, doc: NormalizedDocument) -> list[int]:
+        return phrase_starts([word.doc_positions(doc) for word in self.words])
+
+    def _resolve(self, index: InvertedIndex) -> list[int]:
+        candidates = None
+        for word in sorted(self.words, key=lambda word: len(word.match_ids(index))):
+            postings = word.match_ids(index)
+            candidates = postings if candidates is None else intersect_postings(candidates, postings)
+            if not candidates:
+                return []
+
+        result = []
+        for doc_id in candidates:
+            starts = self.positions(doc_id, index)
+            if starts:
+                result.append(doc_id)
+                self._occurrences[doc_id] = len(starts)
+        return result
+
+    def positions(self, doc_id: int, index: InvertedIndex) -> list[int]:
+        return phrase_starts([word.positions(doc_id, index) for word in self.words])
+
+    def term_matches(self, index: InvertedIndex) -> tuple[np.ndarray, np.ndarray, int]:
+        doc_ids = self.match_ids(index)
+        freqs = [self._occurrences[doc_id] for doc_id in doc_ids]
+        return np.asarray(doc_ids, dtype=np.int64), np.asarray(freqs, dtype=np.float64), len(doc_ids)
+
+class NearNode(PostingsNode):
+    """
+    Proximity operator: both operands (terms or phrases) must occur within
+    distance tokens of each other, in either order.
+    """
+
+    def __init__(self, left: PostingsNode, right: PostingsNode, distance: int):
+        super().__init__()
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    @property
+    def key(self):
+        return ('NEAR', self.distance, self.left.key, self.right.key)
+
+    def _static_estimate(self) -> float:
+        return min(self.left._static_estimate(), self.right._static_estimate()) / 2
+
+    def leaves(self) -> list:
+        return self.left.leaves() + self.right.leaves()
+
+    def matches(self, doc: NormalizedDocument) -> bool:
+        return within_distance(
+            self.left.doc_positions(doc), self.left.length,
+            self.right.doc_positions(doc), self.right.length,
+            self.distance,
+        )
+
+    def _resolve(self, index: InvertedIndex) -> list[int]:
+        return [
+            doc_id for doc_id in intersect_postings(self.left.match_ids(index), self.right.match_ids(index))
+            if within_distance(
+                self.left.positions(doc_id, index), self.left.length,
+                self.right.positions(doc_id, index), self.right.length,
+                self.distance,
+            )
+        ]
+
+class NotNode:
+    """
+    Negation. Inside an AND it is evaluated as a posting list difference.
+    """
+
+    def __init__(self, child):
+        self.child = child
+
+    @property
+    def key(self):
+        return ('NOT', self.child.key)
+
+    def order(self, index: InvertedIndex | None):
+        self.child.order(index)
+
+    def estimate(self, index: InvertedIndex | None) -> float:
+        if index is not None:
+            return index.doc_count - self.child.estimate(index)
+        return 1.0
+
+    def matches(self, doc: NormalizedDocument) -> bool:
+        return not self.child.matches(doc)
+
+    def match_ids(self, index: InvertedIndex) -> list[int]:
+        return difference_postings(index.all_ids(), self.child.match_ids(index))
+
+    def posting_volume(self, index: InvertedIndex) -> int:
+        return self.child.posting_volume(index)
+
+    def leaves(self) -> list:
+        # excluded terms are neither highlighted nor scored
+        return []
+
+    def match_mask(self, index: InvertedIndex) -> np.ndarray:
+        return ~self.child.match_mask(index)
+
+class FieldNode(PostingsNode):
+    """
+    A term or phrase scoped to one metadata field, answered from that field's index.
+    """
+
+    def __init__(self, field: str, node: PostingsNode):
+        super().__init__()
+        self.field = field
+        self.node = node
+
+    @property
+    def key(self):
+        return ('FIELD', self.field, self.node.key)
+
+    def _static_estimate(self) -> float:
+        # metadata values are short, so field terms are assumed to be selective
+        return self.node._static_estimate() / 10
+
+    def leaves(self) -> list:
+        # metadata matches are neither highlighted in content snippets nor scored
+        return []
+
+    def matches(self, doc: NormalizedDocument) -> bool:
+        return self.node.matches(doc.field(self.field))
+
+    def _resolve(self, index: InvertedIndex) -> list[int]:
+        return self.node.match_ids(index.field_index(self.field))
+
+class AndNode:
+    """
+    n-ary conjunction. Operands are ordered most selective first so both the
+    per-document check and the posting list intersection can stop early.
+    """
+
+    def __init__(self, children: list):
+        self.children = children
+
+    @property
+    def key(self):
+        return ('AND', tuple(child.key for child in self.children))
+
+    def order(self, index: InvertedIndex | None):
+        for child in self.children:
+            child.order(index)
+        self.children.sort(key=lambda child: child.estimate(index))
+
+    def estimate(self, index: InvertedIndex | None) -> float:
+        return min((child.estimate(index) for child in self.children), default=0)
+
+    def matches(self, doc: NormalizedDocument) -> bool:
+        return all(child.matches(doc) for child in self.children)
+
+    def match_ids(self, index: InvertedIndex) -> list[int]:
+        if not self.children:
+            return []
+        # negated operands are subtracted from the intersection of the others
+        # instead of being materialized as complements
+        positives = [child for child in self.children if not isinstance(child, NotNode)]
+        negatives = [child for child in self.children if isinstance(child, NotNode)]
+
+        result = positives[0].match_ids(index) if positives else index.all_ids()
+        for child in positives[1:]:
+            if not result:
+                return []
+            result = intersect_postings(result, child.match_ids(index))
+        for child in negatives:
+            if not result:
+                return []
+            result = difference_postings(result, child.child.match_ids(index))
+        return result
+
+    def posting_volume(self, index: InvertedIndex) -> int:
+        return sum(child.posting_volume(index) for child in self.children)
+
+    def leaves(self) -> list:
+        return [leaf for child in self.children for leaf in child.leaves()]
+
+    def match_mask(self, index: InvertedIndex) -> np.ndarray:
+        if not self.children:
+            return np.zeros(index.doc_count, dtype=bool)
+        result = self.children[0].match_mask(index).copy()
+        for child in self.children[1:]:
+            if not result.any():
+                break
+            result &= child.match_mask(index)
+        return result
+
+class OrNode:
+    """
+    n-ary disjunction. Operands are ordered most likely to match first so the
+    per-document check can stop at the first hit.
+    """
+
+    def __init__(self, children: list):
+        self.children = children
+
+    @property
+    def key(self):
+        return ('OR', tuple(child.key for child in self.children))
+
+    def order(self, index: InvertedIndex | None):
+        for child in self.children:
+            child.order(index)
+        self.children.sort(key=lambda child: child.estimate(index), reverse=True)
+
+    def estimate(self, index: InvertedIndex | None) -> float:
+        return sum(child.estimate(index) for child in self.children)
+
+    def matches(self, doc: NormalizedDocument) -> bool:
+        return any(child.matches(doc) for child in self.children)
+
+    def match_ids(self, index: InvertedIndex) -> list[int]:
+        return union_postings([child.match_ids(index) for child in self.children])
+
+    def posting_volume(self, index: InvertedIndex) -> int:
+        return sum(child.posting_volume(index) for child in self.children)
+
+    def leaves(self) -> list:
+        return [leaf for child in self.children for leaf in child.leaves()]
+
+    def match_mask(self, index: InvertedIndex) -> np.ndarray:
+        result = np.zeros(index.doc_count, dtype=bool)
+        for child in self.children:
+            result |= child.match_mask(index)
+        return result
+
+def _build_node(query_expr, exact: bool):
+    if isinstance(query_expr, str):
+        return TermNode(query_expr, exact)
+
+    if isinstance(query_expr, dict):
+        operator = next(iter(query_expr))
+        operands = query_expr[operator]
+
+        if operator == 'NOT':
+            child = _build_node(operands[0], exact)
+            # NOT NOT x -> x
+            return child.child if isinstance(child, NotNode) else NotNode(child)
+
+        elif operator == 'FIELD':
+            field, value = operands
+            # field values are split like the field indexes, so date:01-12-2024 becomes a phrase
+            words = tokenize_field(' '.join(value['PHRASE']) if isinstance(value, dict) else value)
+            if len(words) == 1:
+                return FieldNode(field, TermNode(words[0], exact))
+            if words:
+                return FieldNode(field, PhraseNode(words, exact))
+
+        elif operator == 'PHRASE':
+            if len(operands) == 1:
+                return TermNode(operands[0], exact)
+            if operands:
+                return PhraseNode(operands, exact)
+
+        elif operator.startswith('NEAR/'):
+            left, right = (_build_node(operand, exact) for operand in operands)
+            if isinstance(left, (TermNode, PhraseNode)) and isinstance(right, (TermNode, PhraseNode)):
+                return NearNode(left, right, int(operator.split('/', 1)[1]))
+            # proximity is only defined between terms and phrases, anything else degrades to AND
+            return AndNode([left, right])
+
+        elif operator in ('AND', 'OR'):
+            node_type = AndNode if operator == 'AND' else OrNode
+            children = []
+            seen = set()
+            for operand in operands:
+                child = _build_node(operand, exact)
+                # flatten the parser's binary nesting: (a AND b) AND c -> AND(a, b, c)
+                grandchildren = child.children if isinstance(child, node_type) else [child]
+                for grandchild in grandchildren:
+                    if grandchild.key not in seen:
+                        seen.add(grandchild.key)
+                        children.append(grandchild)
+            return children[0] if len(children) == 1 else node_type(children)
+
+    # an empty or unknown expression matches nothing
+    return OrNode([])
+
+def compile_query(query_expr, exact: bool = False, index: InvertedIndex | None = None):
+    """
+    Compile a parsed boolean query into a flat evaluation plan.
+    Nested binary AND/OR nodes are merged into n-ary nodes, duplicate operands
+    are dropped and operands are ordered by estimated selectivity, using the
+    index's document frequencies when one is given.
+    """
+    plan = _build_node(query_expr, exact)
+    plan.order(index)
+    return plan
+
+def match_plan(plan, index: InvertedIndex) -> list[int]:
+    """
+    Return the sorted ids of documents matching a compiled plan.
+    Sparse queries merge posting lists; queries whose posting lists cover a
+    large part of the corpus (e.g. long OR-lists of spelling variants) are
+    evaluated as vectorized &/| over boolean document masks instead.
+    """
+    if plan.posting_volume(index) > index.doc_count * BITSET_DENSITY:
+        return np.flatnonzero(plan.match_mask(index)).tolist()
+    return plan.match_ids(index)
+
+def rank_matches(plan, index: InvertedIndex, doc_ids: list[int]) -> list[int]:
+    """
+    Order matching doc ids by BM25 relevance to the plan's terms, most relevant first.
+    Ties keep knowledge base order.
+    """
+    if len(doc_ids) < 2:
+        return list(doc_ids)
+    leaves = {leaf.key: leaf for leaf in plan.leaves()}.values()
+    scores = index.bm25_scores(doc_ids, [leaf.term_matches(index) for leaf in leaves])
+    order = np.argsort(-scores, kind='stable')
+    return np.asarray(doc_ids)[order].tolist()
@@ -0,0 +1,83 @@
+import asyncio
+from typing import Awaitable, Callable
+from langchain_core.callbacks import AsyncCallbackManager, CallbackManager
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import get_config_list, patch_config
+
+def _configure(retriever: BaseRetriever, config: RunnableConfig, manager_class):
+    return manager_class.configure(
+        config.get("callbacks"),
+        None,
+        inheritable_tags=config.get("tags"),
+        local_tags=retriever.tags,
+        inheritable_metadata={**(config.get("metadata") or {}), **retriever._get_ls_params()},
+        local_metadata=retriever.metadata,
+    )
+
+def batch_with_callbacks(
+    retriever: BaseRetriever,
+    inputs: list[str],
+    config: RunnableConfig | list[RunnableConfig] | None,
+    run_batch: Callable[[list[str], list[RunnableConfig]], list[list[Document]]],
+    return_exceptions: bool = False,
+) -> list[list[Document] | Exception]:
+    """
+    Retrieve a whole batch with one run_batch call while reporting a retriever
+    run per query to the configured callbacks, the way invoke does, so batched
+    retrievals are traced too. run_batch gets the queries and, per query, a
+    config whose callbacks are children of that query's run. max_concurrency
+    does not apply to the batch itself, which is a single call.
+    """
+    configs = get_config_list(config, len(inputs))
+    run_managers = [
+        _configure(retriever, query_config, CallbackManager).on_retriever_start(
+            None, query, name=query_config.get("run_name") or retriever.get_name(), run_id=query_config.pop("run_id", None),
+        )
+        for query, query_config in zip(inputs, configs)
+    ]
+    child_configs = [
+        patch_config(query_config, callbacks=run_manager.get_child())
+        for query_config, run_manager in zip(configs, run_managers)
+    ]
+    try:
+        results = run_batch(inputs, child_configs)
+    except Exception as e:
+        for run_manager in run_managers:
+            run_manager.on_retriever_error(e)
+        if return_exceptions:
+            return [e for _ in inputs]
+        raise
+    for run_manager, result in zip(run_managers, results):
+        run_manager.on_retriever_end(result)
+    return results
+
+async def abatch_with_callbacks(
+    retriever: BaseRetriever,
+    inputs: list[str],
+    config: RunnableConfig | list[RunnableConfig] | None,
+    run_batch: Callable[[list[str], list[RunnableConfig]], Awaitable[list[list[Document]]]],
+    return_exceptions: bool = False,
+) -> list[list[Document] | Exception]:
+    """Async version of batch_with_callbacks."""
+    configs = get_config_list(config, len(inputs))
+    run_managers = await asyncio.gather(*[
+        _configure(retriever, query_config, AsyncCallbackManager).on_retriever_start(
+            None, query, name=query_config.get("run_name") or retriever.get_name(), run_id=query_config.pop("run_id", None),
+        )
+        for query, query_config in zip(inputs, configs)
+    ])
+    child_configs = [
+        patch_config(query_config, callbacks=run_manager.get_child())
+        for query_config, run_manager in zip(configs, run_managers)
+    ]
+    try:
+        results = await run_batch(inputs, child_configs)
+    except Exception as e:
+        await asyncio.gather(*[run_manager.on_retriever_error(e) for run_manager in run_managers])
+        if return_exceptions:
+            return [e for _ in inputs]
+        raise
+    await asyncio.gather(*[run_manager.on_retriever_end(result) for run_manager, result in zip(run_managers, results)])
+    return results
@@ -1,17 +1,32 @@
 from langchain_core.documents import Document
 from langchain_pinecone import PineconeVectorStore
 from langchain_openai import OpenAIEmbeddings
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from langchain_core.retrievers import BaseRetriever
 import pinecone
 from pinecone import Pinecone, ServerlessSpec
+import asyncio
+import heapq
+from typing import Literal
 import json
+import math
 import time
 from pprint import pprint, pformat
 import logging
 import dotenv
 from rapidfuzz import fuzz, process
-from metaphone import doublemetaphone
+import numpy as np
+import os
+from search_index import character_ngrams
+from phonetic import PhoneticEncoder
+from retriever_batch import abatch_with_callbacks, batch_with_callbacks
+from embedding_cache import CachedEmbeddings
+from knowledge_base import TOMBSTONE_KEY, KnowledgeBaseStore, read_records
+from vector_registry import IngestedRegistry, content_hash
+from fuzzy_cache import (
+    CACHE_FORMAT_VERSION, DocCache, MetadataColumn, PostingsTable, StringColumn,
+    documents_hash, load_fuzzy_cache, python_size, save_fuzzy_cache,
+)
 
 dotenv.load_dotenv()
 
@@ -32,8 +47,12 @@ def clean_metadata(metadata):
     return cleaned_metadata
 
   
-def add_to_vector_store(documents: list[Document]) -> None:
-    vector_db = load_vector_store()
+def add_to_vector_store(documents: list[Document], vector_db: PineconeVectorStore | None = None,
+                        registry: IngestedRegistry | None = None) -> None:
+    if vector_db is None:
+        vector_db = load_vector_store()
+    if registry is None:
+        registry = IngestedRegistry(VECTOR_REGISTRY_PATH, vector_db._index)
     
     # Clean documents
     cleaned_documents = [
@@ -44,35 +63,77 @@ def add_to_vector_store(documents: list[Document]) -> None:
     ]
     
     doc_ids = [get_doc_id(doc) for doc in cleaned_documents]
-    existing_ids = sum(list(vector_db._index.list()),[])
+    stored_hashes = registry.stored_hashes(doc_ids)
     
-    existing_docs = []
-    existing_doc_ids = []
     new_docs = []
     new_doc_ids = []
+    changed_docs = []
+    changed_doc_ids = []
     
     for doc, doc_id in zip(cleaned_documents, doc_ids):
-        if doc_id in existing_ids:
-            existing_docs.append(doc)
-            existing_doc_ids.append(doc_id)
-        else:
+        if doc_id not in stored_hashes:
             new_docs.append(doc)
             new_doc_ids.append(doc_id)
-    logging.info(f"Adding {len(new_docs)} new documents to vector store")
-    
-    # # Update existing documents
-    # if existing_docs:
-    #     vector_db.update_documents(
-    #         ids=existing_doc_ids,
-    #         documents=existing_docs
-    #     )
+        elif stored_hashes[doc_id] != content_hash(doc):
+            changed_docs.append(doc)
+            changed_doc_ids.append(doc_id)
+    logging.info(f"Adding {len(new_docs)} new and updating {len(changed_docs)} changed documents in vector store")
     
-    # Add new documents
-    if new_docs:
+    # Add new documents and overwrite changed ones; unchanged documents are not re-embedded
+    upsert_docs = new_docs + changed_docs
+    upsert_ids = new_doc_ids + changed_doc_ids
+    if upsert_docs:
         vector_db.add_documents(
-            documents=new_docs,
-            ids=new_doc_ids
+            documents=upsert_docs,
+            ids=upsert_ids
         )
+        registry.record({doc_id: content_hash(doc) for doc, doc_id in zip(upsert_docs, upsert_ids)})
+
+def remove_deleted_from_vector_store(documents: list[Document], vector_db: PineconeVectorStore | None = None,
+                                     registry: IngestedRegistry | None = None, batch_size: int = 1000) -> list[str]:
+    """
+    Delete the documents that are in the vector store but no longer among documents. Returns their ids.
+    Only ids of the sources that documents come from are considered, so an
+    ingestion run over part of the archive cannot delete the rest of the index.
+    """
+    if not documents:
+        logging.warning("No documents given, not deleting anything from vector store")
+        return []
+    if vector_db is None:
+        vector_db = load_vector_store()
+    if registry is None:
+        registry = IngestedRegistry(VECTOR_REGISTRY_PATH, vector_db._index)
+    
+    source_prefixes = tuple({f"{doc.metadata['source']}-" for doc in documents})
+    current_ids = {get_doc_id(doc) for doc in documents}
+    deleted_ids = sorted(
+        doc_id for doc_id in registry.all_ids() if doc_id.startswith(source_prefixes) and doc_id not in current_ids
+    )
+    logging.info(f"Deleting {len(deleted_ids)} documents from vector store")
+    for i in range(0, len(deleted_ids), batch_size):
+        batch = deleted_ids[i:i + batch_size]
+        vector_db.delete(ids=batch)
+        registry.forget(batch)
+    return deleted_ids
+
+def sync_vector_store(articles: list[Document], vector_db: PineconeVectorStore | None = None,
+                      registry: IngestedRegistry | None = None, batch_size: int = 100,
+                      delete_missing: bool = False) -> list[str]:
+    """
+    Add new and changed articles to the vector store in batches. With
+    delete_missing, also delete the documents of the articles' sources that
+    are no longer among them, e.g. after an issue was re-parsed. Returns the
+    deleted ids.
+    """
+    if vector_db is None:
+        vector_db = load_vector_store()
+    if registry is None:
+        registry = IngestedRegistry(VECTOR_REGISTRY_PATH, vector_db._index)
+    for i in range(0, len(articles), batch_size):
+        add_to_vector_store(articles[i:i + batch_size], vector_db=vector_db, registry=registry)
+    if not delete_missing:
+        return []
+    return remove_deleted_from_vector_store(articles, vector_db=vector_db, registry=registry)
 
 def create_or_fetch_pinecone_index(index_name:str)->pinecone.Index:
     pc = Pinecone()
@@ -92,13 +153,21 @@ def create_or_fetch_pinecone_index(index_name:str)->pinecone.Index:
             time.sleep(1)
 
 
+EMBEDDING_CACHE_PATH = ".cache/embeddings.sqlite"
+VECTOR_REGISTRY_PATH = ".cache/chitrapur-gpt-registry.sqlite"
+
 def load_vector_store()->PineconeVectorStore:
     index = create_or_fetch_pinecone_index("chitrapur-gpt")
-    return PineconeVectorStore(index=index, embedding=OpenAIEmbeddings(model="text-embedding-3-large"))
+    embeddings = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-3-large"), path=EMBEDDING_CACHE_PATH)
+    return PineconeVectorStore(index=index, embedding=embeddings)
 
 def get_doc_id(doc: Document) -> str:
-    """Generate a unique identifier for a document based on source and title."""
-    return f"{doc.metadata['source']}-{doc.metadata['title']}"
+    """Generate a unique identifier for a document based on source and title, plus the chunk index for chunks of long articles."""
+    doc_id = f"{doc.metadata['source']}-{doc.metadata['title']}"
+    if 'chunk_index' in doc.metadata:
+        # Pinecone returns the index as a float
+        doc_id += f"-{int(doc.metadata['chunk_index'])}"
+    return doc_id
 
 def save_doc_to_json(doc: Document, file_path: str) -> None:
     with open(file_path, 'w') as json_file:
@@ -110,77 +179,126 @@ def load_doc_from_json(file_path: str) -> Document:
         return Document(**data)
     
 def load_docs_from_jsonl(file_path: str) -> list[Document]:
-    """Load documents from a JSONL file."""
-    array = []
-    with open(file_path, 'r') as jsonl_file:
-        for line in jsonl_file:
-            data = json.loads(line)
-            obj = Document(**data)
-            array.append(obj)
-    return array
+    """
+    Load documents from a JSONL file.
+    The knowledge base is an append-only log, so when a document has several
+    records the last one wins, at the position of the first. Tombstone records
+    delete the document with their id.
+    """
+    docs = {}
+    for _, _, data in read_records(file_path):
+        if TOMBSTONE_KEY in data:
+            docs.pop(data[TOMBSTONE_KEY], None)
+            continue
+        doc = Document(**data)
+        docs[doc_key(doc)] = doc
+    return list(docs.values())
 
 def save_docs_to_jsonl(docs: list[Document], file_path: str) -> None:
-    """Save documents to a JSONL file, merging with existing documents if any."""
-    # Load existing documents if file exists
-    existing_docs = {}
-    try:
-        docs_in_knowledge_base = load_docs_from_jsonl(file_path)
-        for doc in docs_in_knowledge_base:
-            existing_docs[get_doc_id(doc)] = doc
-    except FileNotFoundError:
-        pass
-    
-    # Add new documents or update existing ones
-    for doc in docs:
-        existing_docs[get_doc_id(doc)] = doc
-    
-    # Write all documents back to file
-    with open(file_path, 'w') as jsonl_file:
-        for doc in existing_docs.values():
-            jsonl_file.write(doc.model_dump_json() + '\n')
+    """Add new documents to a JSONL knowledge base and update changed ones by appending records."""
+    store = KnowledgeBaseStore(file_path, key=get_doc_id)
+    store.append(docs)
+    # superseded records are dropped without holding up ingestion
+    store.compact_in_background()
 
 def format_docs(docs: list[Document]) -> str:
     return "\n".join([f"{i}. {doc.metadata['title']}\n Metadata:\n{pformat(doc.metadata)}\nContent:\n{doc.page_content}\n{'-'*100}" for i, doc in enumerate(docs)])
 
-def deduplicate_docs(docs: list[Document]) -> list[Document]:
-    docs = sum(docs, [])
+def doc_key(doc: Document) -> str:
+    """get_doc_id for documents that carry source and title metadata, the content otherwise."""
+    if 'source' in doc.metadata and 'title' in doc.metadata:
+        return get_doc_id(doc)
+    return doc.page_content
+
+def deduplicate_docs(docs: list[list[Document]]) -> list[Document]:
+    docs = [doc for results in docs for doc in results]
     seen = set()
     unique_docs = []
     for doc in docs:
-        doc_id = (doc.page_content, str(doc.metadata))
+        doc_id = doc_key(doc)
         if doc_id not in seen:
             seen.add(doc_id)
             unique_docs.append(doc)
     logging.info(f"deduplicated {len(docs)} docs to {len(unique_docs)} docs")
     return unique_docs
 
+def reciprocal_rank_fusion(result_lists: list[list[Document]], weights: list[float] | None = None,
+                           k: int = 60, limit: int | None = None) -> list[Document]:
+    """
+    Merge ranked result lists by weighted reciprocal rank: a document scores
+    weight / (k + rank) in every list it appears in. Duplicates (by doc_key)
+    are merged, keeping the first copy seen; ties keep first-seen order.
+    """
+    if weights is None:
+        weights = [1.0] * len(result_lists)
+    scores: dict[str, float] = {}
+    fused: dict[str, Document] = {}
+    for weight, results in zip(weights, result_lists):
+        for rank, doc in enumerate(results, start=1):
+            key = doc_key(doc)
+            fused.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    ranked = sorted(fused, key=scores.__getitem__, reverse=True)
+    return [fused[key] for key in ranked[:limit]]
+
 class FuzzyMatchRetriever(BaseRetriever):
     documents: list[Document]
     k: int
     content_weight: float = 0.9
     metadata_weight: float = 0.1
     threshold: float = 30
+    # number of documents kept by the candidate stage before fuzzy scoring; None scores every document
+    candidate_limit: int | None = 300
+    # share of a query word's character n-grams a vocabulary word must have to count as a spelling variant
+    ngram_similarity: float = 0.5
+    # rapidfuzz worker threads for batch scoring, -1 uses all cores
+    workers: int = -1
+    
+    # directory to persist the pre-processed cache in, one subdirectory per corpus; None keeps it in memory only
+    cache_dir: str | None = None
+    # identifies the corpus, e.g. the hash of knowledge_base.jsonl; hashed from the documents if not given
+    cache_key: str | None = None
     
     def __init__(self, **kwargs):
         """Initialize with pre-processed document data for faster matching."""
         super().__init__(**kwargs)
-        self._initialize_document_cache()
+        if self.cache_dir is None or not self._load_document_cache():
+            self._initialize_document_cache()
+            if self.cache_dir is not None:
+                save_fuzzy_cache(
+                    self._cache_path(), self._doc_cache, self._candidate_tables(),
+                    self._vocabulary, self._phonetic.vocabulary_codes,
+                )
+    
+    def _cache_path(self) -> str:
+        key = self.cache_key or documents_hash(self.documents)
+        return os.path.join(self.cache_dir, f"{key}-v{CACHE_FORMAT_VERSION}")
+    
+    def _load_document_cache(self) -> bool:
+        """Load the memory-mapped cache of this corpus from cache_dir. Returns False if there is none yet."""
+        cached = load_fuzzy_cache(self._cache_path(), self.documents)
+        if cached is None:
+            return False
+        self._doc_cache, tables, self._vocabulary, phonetic_codes = cached
+        self._phonetic = PhoneticEncoder(phonetic_codes)
+        self._content_token_index = tables['content_tokens']
+        self._metadata_token_index = tables['metadata_tokens']
+        self._phonetic_index = tables['phonetic']
+        self._ngram_index = tables['ngrams']
+        return True
     
     def _initialize_document_cache(self):
         """Pre-process documents once during initialization."""
-        self._doc_cache = []
+        contents, phonetics, metadata, metadata_phonetics = [], [], [], []
+        # every distinct word is encoded once, however often it occurs
+        self._phonetic = PhoneticEncoder()
         
         for doc in self.documents:
-            # Pre-compute lowercase content and tokens
+            # Pre-compute lowercase content
             content = doc.page_content.lower()
-            content_tokens = set(content.split())
             
             # Pre-compute phonetic codes for content
-            content_phonetic = ' '.join([
-                doublemetaphone(word)[0] 
-                for word in content.split() 
-                if word
-            ])
+            content_phonetic = self._phonetic.learn_text(content)
             
             # Pre-process metadata
             important_metadata = {
@@ -191,93 +309,356 @@ class FuzzyMatchRetriever(BaseRetriever):
             
             # Pre-compute phonetic codes for metadata
             metadata_phonetic = {
-                k: ' '.join([
-                    doublemetaphone(word)[0] 
-                    for word in v.split() 
-                    if word
-                ])
+                k: self._phonetic.learn_text(v)
                 for k, v in important_metadata.items()
             }
             
-            self._doc_cache.append({
-                'document': doc,
-                'content': content,
-                'content_tokens': content_tokens,
-                'content_phonetic': content_phonetic,
-                'metadata': important_metadata,
-                'metadata_phonetic': metadata_phonetic
-            })
+            contents.append(content)
+            phonetics.append(content_phonetic)
+            metadata.append(important_metadata)
+            metadata_phonetics.append(metadata_phonetic)
+
+        self._doc_cache = DocCache(
+            self.documents, StringColumn.from_strings(contents), StringColumn.from_strings(phonetics),
+            MetadataColumn.from_dicts(metadata, metadata_phonetics),
+        )
+
+        stats = self._phonetic.stats()
+        logging.info(f"phonetic codes for {stats['hits'] + stats['misses']} words took {stats['misses']} doublemetaphone calls")
+
+        self._build_candidate_indexes()
+
+    def phonetic_stats(self) -> dict:
+        """Size and hit/miss counts of the memoized phonetic codes."""
+        return self._phonetic.stats()
+
+    def memory_report(self) -> dict[str, int]:
+        """
+        Approximate bytes used by the pre-processed cache, per component.
+        When the cache was loaded from cache_dir, the columns and indexes are
+        memory-mapped and shared through the page cache by all workers.
+        """
+        report = dict(self._doc_cache.memory_usage())
+        for name, table in self._candidate_tables().items():
+            report[f'{name}_index'] = table.nbytes
+        report['vocabulary'] = python_size(self._vocabulary)
+        report['phonetic_codes'] = python_size(self._phonetic.vocabulary_codes)
+        report['total'] = sum(report.values())
+        return report
+
+    def _build_candidate_indexes(self):
+        """
+        Build the token, phonetic-code and character n-gram inverted indexes
+        used to narrow the corpus down to candidates before fuzzy scoring.
+        Content tokens are indexed separately from metadata tokens, since token
+        overlap only counts content.
+        """
+        content_postings: dict[str, list[int]] = {}
+        metadata_postings: dict[str, list[int]] = {}
+        phonetic_postings: dict[str, list[int]] = {}
+        
+        for doc_idx, doc_data in enumerate(self._doc_cache):
+            metadata_tokens = set()
+            codes = set(doc_data.content_phonetic.split())
+            for value in doc_data.metadata.values():
+                metadata_tokens.update(value.split())
+            for value in doc_data.metadata_phonetic.values():
+                codes.update(value.split())
+            
+            for token in set(doc_data.content.split()):
+                content_postings.setdefault(token, []).append(doc_idx)
+            for token in metadata_tokens:
+                metadata_postings.setdefault(token, []).append(doc_idx)
+            for code in codes:
+                phonetic_postings.setdefault(code, []).append(doc_idx)
+        
+        self._content_token_index = PostingsTable.from_dict(content_postings)
+        self._metadata_token_index = PostingsTable.from_dict(metadata_postings)
+        self._phonetic_index = PostingsTable.from_dict(phonetic_postings)
+        
+        # n-gram -> ids of vocabulary tokens, to find spelling variants of query words
+        self._vocabulary = list(dict.fromkeys([*content_postings, *metadata_postings]))
+        ngram_postings: dict[str, list[int]] = {}
+        for token_id, token in enumerate(self._vocabulary):
+            for ngram in character_ngrams(token):
+                ngram_postings.setdefault(ngram, []).append(token_id)
+        self._ngram_index = PostingsTable.from_dict(ngram_postings)
+
+    def _candidate_tables(self) -> dict[str, PostingsTable]:
+        return {
+            'content_tokens': self._content_token_index,
+            'metadata_tokens': self._metadata_token_index,
+            'phonetic': self._phonetic_index,
+            'ngrams': self._ngram_index,
+        }
+
+    def _token_postings(self, token: str) -> np.ndarray | None:
+        """Ids of the documents containing token in their content or metadata."""
+        content = self._content_token_index.get(token)
+        metadata = self._metadata_token_index.get(token)
+        if content is None or metadata is None:
+            return metadata if content is None else content
+        return np.union1d(content, metadata)
+
+    def _similar_tokens(self, word: str) -> list[tuple[str, float]]:
+        """Return vocabulary tokens sharing enough character n-grams with word, with the shared fraction."""
+        ngrams = character_ngrams(word)
+        if not ngrams:
+            return []
+        shared = {}
+        for ngram in ngrams:
+            postings = self._ngram_index.get(ngram)
+            if postings is None:
+                continue
+            for token_id in postings.tolist():
+                shared[token_id] = shared.get(token_id, 0) + 1
+        return [
+            (self._vocabulary[token_id], count / len(ngrams))
+            for token_id, count in shared.items()
+            if count / len(ngrams) >= self.ngram_similarity
+        ]
+
+    def _candidate_indices(self, query_tokens: set[str], query_phonetic: str) -> np.ndarray | None:
+        """
+        Pick the documents worth fuzzy scoring for a query.
+        Documents get IDF-weighted credit for sharing a word, a spelling variant
+        (by character n-grams) or a phonetic code with the query, and the best
+        candidate_limit of them are kept. Returns None when every document
+        should be scored.
+        """
+        n_docs = len(self._doc_cache)
+        if self.candidate_limit is None or n_docs <= self.candidate_limit:
+            return None
+        
+        scores = np.zeros(n_docs)
+        
+        def add(postings, weight=1.0):
+            scores[postings] += weight * math.log(1 + n_docs / len(postings))
+        
+        for word in query_tokens:
+            postings = self._token_postings(word)
+            if postings is not None:
+                add(postings, 2.0)
+            for token, similarity in self._similar_tokens(word):
+                if token != word:
+                    add(self._token_postings(token), similarity)
+        for code in set(query_phonetic.split()):
+            if code in self._phonetic_index:
+                add(self._phonetic_index[code])
+        
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            # nothing in common with any document, fall back to scoring everything
+            return None
+        if len(hits) <= self.candidate_limit:
+            return hits
+        return np.sort(np.argpartition(-scores, self.candidate_limit - 1)[:self.candidate_limit])
 
     def _get_relevant_documents(
         self, query: str, *, run_manager: CallbackManagerForRetrieverRun
     ) -> list[Document]:
         """More efficient implementation using pre-processed data."""
-        query = query.lower()
-        query_tokens = set(query.split())
-        query_phonetic = ' '.join([
-            doublemetaphone(word)[0] 
-            for word in query.split() 
-            if word
-        ])
+        return self._score_queries([query])[0]
+
+    def batch(self, inputs: list[str], config=None, *, return_exceptions: bool = False, **kwargs) -> list[list[Document]]:
+        """Score all queries of a batch together as one query-by-document matrix, tracing a run per query."""
+        inputs = list(inputs)
+        if not inputs:
+            return []
+        return batch_with_callbacks(self, inputs, config, lambda queries, _: self._score_queries(queries), return_exceptions)
+
+    def _score_queries(self, queries: list[str]) -> list[list[Document]]:
+        """
+        Rank documents for several queries at once.
+        The fuzzy scores of all queries against the union of their candidates are
+        computed with rapidfuzz's multi-threaded cdist; each query is then ranked
+        over its own candidates only, exactly as if it had been scored alone.
+        """
+        queries = [query.lower() for query in queries]
+        query_tokens = [set(query.split()) for query in queries]
+        query_phonetics = [self._phonetic.encode_text(query) for query in queries]
+        
+        candidates = [self._candidate_indices(tokens, phonetic) for tokens, phonetic in zip(query_tokens, query_phonetics)]
+        if any(c is None for c in candidates):
+            columns = np.arange(len(self._doc_cache))
+        else:
+            columns = np.unique(np.concatenate(candidates)) if candidates else np.zeros(0, dtype=int)
+        doc_cache = self._doc_cache
+        
+        # Phonetic matching (using pre-computed codes)
+        phonetic_scores = process.cdist(
+            query_phonetics, [doc_cache.phonetics[i] for i in columns],
+            scorer=fuzz.token_set_ratio, workers=self.workers, dtype=np.float64,
+        )
         
-        matching_documents = []
+        # Metadata matching, best score over all plain and phonetic metadata values of a document
+        metadata_ratios = np.zeros((len(queries), len(columns)))
+        values, phonetic_values, owners = [], [], []
+        for column, i in enumerate(columns.tolist()):
+            entries = doc_cache.metadata.entries(i)
+            values.extend(doc_cache.metadata.values[j] for j in entries)
+            phonetic_values.extend(doc_cache.metadata.phonetics[j] for j in entries)
+            owners.extend([column] * len(entries))
+        if values:
+            scores = process.cdist(queries, values, scorer=fuzz.ratio, workers=self.workers, dtype=np.float64)
+            for row in range(len(queries)):
+                np.maximum.at(metadata_ratios[row], owners, scores[row])
+        if phonetic_values:
+            scores = process.cdist(query_phonetics, phonetic_values, scorer=fuzz.token_set_ratio, workers=self.workers, dtype=np.float64)
+            for row in range(len(queries)):
+                np.maximum.at(metadata_ratios[row], owners, scores[row])
         
-        # Process documents in batches for better performance
-        batch_size = 100
-        for i in range(0, len(self._doc_cache), batch_size):
-            batch = self._doc_cache[i:i + batch_size]
+        results = []
+        for row, query in enumerate(queries):
+            if candidates[row] is None:
+                row_columns = np.arange(len(columns))
+            else:
+                row_columns = np.searchsorted(columns, candidates[row])
+            top = self._top_k(
+                query, columns[row_columns],
+                self._token_overlaps(query_tokens[row], columns[row_columns]),
+                phonetic_scores[row, row_columns], metadata_ratios[row, row_columns],
+            )
+            results.append(top)
+        
+        return results
+
+    def _token_overlaps(self, query_tokens: set[str], doc_indices: np.ndarray) -> np.ndarray:
+        """Percentage of the query's words found in the content of each of the given documents."""
+        if not query_tokens:
+            return np.zeros(len(doc_indices))
+        counts = np.zeros(len(self._doc_cache))
+        for word in query_tokens:
+            postings = self._content_token_index.get(word)
+            if postings is not None:
+                counts[postings] += 1
+        return counts[doc_indices] / len(query_tokens) * 100
+
+    def _top_k(self, query: str, doc_indices: np.ndarray, token_overlaps: np.ndarray,
+               phonetic_scores: np.ndarray, metadata_ratios: np.ndarray) -> list[Document]:
+        """
+        Select the k best documents by (phonetic_score, token_overlap, ratio).
+        partial_ratio, the expensive part of ratio, is only computed for documents
+        that can still enter the top k: documents are visited in decreasing
+        (phonetic_score, token_overlap) order, skipped if even a perfect
+        partial_ratio cannot lift them over the threshold, and the scan stops once
+        k documents passed and the next one ranks below the k-th on those keys.
+        """
+        upper_bounds = (
+            self.content_weight * (100 + token_overlaps + phonetic_scores) / 3 +
+            self.metadata_weight * metadata_ratios
+        )
+        eligible = np.flatnonzero(upper_bounds > self.threshold)
+        # stable, so documents with equal keys keep their corpus order like the full sort did
+        order = eligible[np.lexsort((-token_overlaps[eligible], -phonetic_scores[eligible]))]
+        
+        # min-heap of (phonetic_score, token_overlap, ratio, -position); the root is the current k-th best
+        top = []
+        chunk_size = max(4 * self.k, 16)
+        for start in range(0, len(order), chunk_size):
+            chunk = order[start:start + chunk_size]
+            if len(top) == self.k and (phonetic_scores[chunk[0]], token_overlaps[chunk[0]]) < top[0][:2]:
+                break
             
-            for doc_data in batch:
-                # Token overlap (pre-computed sets)
-                token_overlap = len(query_tokens & doc_data['content_tokens']) / len(query_tokens) * 100
-                
-                # Content matching
-                content_ratio = fuzz.partial_ratio(query, doc_data['content'])
-                
-                # Phonetic matching (using pre-computed codes)
-                phonetic_score = fuzz.token_set_ratio(query_phonetic, doc_data['content_phonetic'])
-                
-                # Metadata matching
-                metadata_scores = []
-                for value in doc_data['metadata'].values():
-                    fuzzy_score = fuzz.ratio(query, value)
-                    metadata_scores.append(fuzzy_score)
-                
-                # Phonetic metadata matching
-                for phonetic_value in doc_data['metadata_phonetic'].values():
-                    phonetic_meta_score = fuzz.token_set_ratio(query_phonetic, phonetic_value)
-                    metadata_scores.append(phonetic_meta_score)
-                
-                metadata_ratio = max(metadata_scores) if metadata_scores else 0
+            # Content matching
+            content_ratios = process.cdist(
+                [query], [self._doc_cache.contents[doc_indices[i]] for i in chunk],
+                scorer=fuzz.partial_ratio, workers=self.workers, dtype=np.float64,
+            )[0]
+            
+            for i, content_ratio in zip(chunk.tolist(), content_ratios.tolist()):
+                phonetic_score = float(phonetic_scores[i])
+                token_overlap = float(token_overlaps[i])
+                if len(top) == self.k and (phonetic_score, token_overlap) < top[0][:2]:
+                    break
                 
                 # Combined score
                 content_score = (content_ratio + token_overlap + phonetic_score) / 3
                 match_ratio = (
                     self.content_weight * content_score + 
-                    self.metadata_weight * metadata_ratio
+                    self.metadata_weight * float(metadata_ratios[i])
                 )
                 
                 if match_ratio > self.threshold:
-                    matching_documents.append({
-                        "document": doc_data['document'],
-                        "ratio": match_ratio,
-                        "token_overlap": token_overlap,
-                        "phonetic_score": phonetic_score
-                    })
+                    entry = (phonetic_score, token_overlap, match_ratio, -i)
+                    if len(top) < self.k:
+                        heapq.heappush(top, entry)
+                    elif entry > top[0]:
+                        heapq.heapreplace(top, entry)
         
-        # Sort only the documents that passed the threshold
-        matching_documents.sort(
-            key=lambda x: (x["phonetic_score"], x["token_overlap"], x["ratio"]), 
-            reverse=True
-        )
-        
-        return [x["document"] for x in matching_documents][:self.k]
+        return [self._doc_cache.documents[doc_indices[-entry[3]]] for entry in sorted(top, reverse=True)]
 
 class HybridRetriever(BaseRetriever):
     fuzzy_retriever: FuzzyMatchRetriever
     vector_db_retriever: BaseRetriever
+    # seconds the async methods wait for each branch; a branch that times out contributes no documents
+    fuzzy_timeout: float | None = None
+    vector_timeout: float | None = None
+    # "concat" appends the vector results to the fuzzy ones, "rrf" merges both by weighted reciprocal rank
+    fusion: Literal["concat", "rrf"] = "concat"
+    fuzzy_weight: float = 1.0
+    vector_weight: float = 1.0
+    rrf_k: int = 60
+    # most documents returned per query
+    max_docs: int | None = None
+
+    def _combine(self, fuzzy_docs: list[Document], vector_docs: list[Document]) -> list[Document]:
+        if self.fusion == "rrf":
+            return reciprocal_rank_fusion(
+                [fuzzy_docs, vector_docs], [self.fuzzy_weight, self.vector_weight], self.rrf_k, self.max_docs,
+            )
+        return (fuzzy_docs + vector_docs)[:self.max_docs]
 
     def _get_relevant_documents(
         self, query: str, *, run_manager: CallbackManagerForRetrieverRun
     ) -> list[Document]:
-        return self.fuzzy_retriever.invoke(query) + self.vector_db_retriever.invoke(query)
+        config = {"callbacks": run_manager.get_child()}
+        return self._combine(self.fuzzy_retriever.invoke(query, config), self.vector_db_retriever.invoke(query, config))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        """Run the CPU-bound fuzzy search in a worker thread while the vector query is awaited."""
+        config = {"callbacks": run_manager.get_child()}
+        fuzzy_docs, vector_docs = await asyncio.gather(
+            self._run_branch("fuzzy", asyncio.to_thread(self.fuzzy_retriever.invoke, query, config), self.fuzzy_timeout, []),
+            self._run_branch("vector", self.vector_db_retriever.ainvoke(query, config), self.vector_timeout, []),
+        )
+        return self._combine(fuzzy_docs, vector_docs)
+
+    def batch(self, inputs: list[str], config=None, *, return_exceptions: bool = False, **kwargs) -> list[list[Document]]:
+        """Let the fuzzy retriever score the whole batch at once, then add the vector results per query."""
+        inputs = list(inputs)
+        if not inputs:
+            return []
+
+        def run_batch(queries: list[str], configs: list) -> list[list[Document]]:
+            fuzzy_results = self.fuzzy_retriever.batch(queries, configs)
+            vector_results = self.vector_db_retriever.batch(queries, configs, **kwargs)
+            return [self._combine(fuzzy_docs, vector_docs) for fuzzy_docs, vector_docs in zip(fuzzy_results, vector_results)]
+
+        return batch_with_callbacks(self, inputs, config, run_batch, return_exceptions)
+
+    async def abatch(self, inputs: list[str], config=None, *, return_exceptions: bool = False, **kwargs) -> list[list[Document]]:
+        """Async batch: the fuzzy batch runs in a worker thread concurrently with the vector queries."""
+        inputs = list(inputs)
+        if not inputs:
+            return []
+
+        async def run_batch(queries: list[str], configs: list) -> list[list[Document]]:
+            empty = [[] for _ in queries]
+            fuzzy_results, vector_results = await asyncio.gather(
+                self._run_branch("fuzzy", asyncio.to_thread(self.fuzzy_retriever.batch, queries, configs), self.fuzzy_timeout, empty),
+                self._run_branch("vector", self.vector_db_retriever.abatch(queries, configs, **kwargs), self.vector_timeout, empty),
+            )
+            return [self._combine(fuzzy_docs, vector_docs) for fuzzy_docs, vector_docs in zip(fuzzy_results, vector_results)]
+
+        return await abatch_with_callbacks(self, inputs, config, run_batch, return_exceptions)
+
+    @staticmethod
+    async def _run_branch(name: str, awaitable, timeout: float | None, default):
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"{name} retrieval timed out after {timeout}s")
+            return default
@@ -1,21 +1,79 @@
 import re
-from retrievers import load_docs_from_jsonl
+import threading
+from langchain_core.documents import Document
+from corpus_cache import get_corpus
+from search_index import FIELDS, InvertedIndex
+from query_plan import compile_query, match_plan, normalize_document, rank_matches
+from snippets import AhoCorasick, find_snippet_windows
+
+_search_indexes: dict[str, tuple[str, InvertedIndex]] = {}
+_search_index_lock = threading.Lock()
+
+def get_search_index(file_path: str = "knowledge_base.jsonl") -> InvertedIndex:
+    """
+    Return the inverted index for the knowledge base at file_path.
+    The index is built from the cached corpus on first use and rebuilt only
+    when the corpus is reloaded because the file changed.
+    """
+    corpus = get_corpus(file_path)
+    entry = _search_indexes.get(file_path)
+    if entry is None or entry[0] != corpus.version:
+        with _search_index_lock:
+            entry = _search_indexes.get(file_path)
+            if entry is None or entry[0] != corpus.version:
+                entry = (corpus.version, InvertedIndex(corpus.documents, corpus.tokens, corpus.contents))
+                _search_indexes[file_path] = entry
+    return entry[1]
+
+DEFAULT_NEAR_DISTANCE = 5
 
 def tokenize_query(query: str):
     """
-    Tokenize a boolean query into tokens (terms, operators, and parentheses)
+    Tokenize a boolean query into tokens (terms, quoted phrases, operators, and parentheses)
+    """
+    # Field scoped phrases, quoted phrases (an unclosed quote runs to the end of
+    # the query), parentheses, and whitespace separated terms
+    return re.findall(r'\w+:"[^"]*"?|"[^"]*"?|\(|\)|[^\s()"]+', query)
+
+def parse_operand(token: str):
+    """
+    Parse a term, quoted phrase or field:value token into its query structure.
+    Returns None for tokens that carry no search terms (e.g. an empty phrase).
     """
-    # Replace parentheses with spaces around them to make them separate tokens
-    query = re.sub(r'\(', ' ( ', query)
-    query = re.sub(r'\)', ' ) ', query)
+    field_match = re.fullmatch(r'(\w+):(.+)', token)
+    if field_match and field_match.group(1).lower() in FIELDS:
+        # the value is a term or phrase, never another field, so title:author:x searches titles for "author:x"
+        value = parse_term(field_match.group(2))
+        return {'FIELD': [field_match.group(1).lower(), value]} if value is not None else None
+    return parse_term(token)
+
+def parse_term(token: str):
+    """Parse a term or quoted phrase token. Returns None for an empty phrase."""
+    if token.startswith('"'):
+        # Quoted phrase
+        words = token.strip('"').split()
+        return {'PHRASE': words} if words else None
     
-    # Split by whitespace and filter out empty strings
-    tokens = [token for token in query.split() if token]
-    return tokens
+    # Regular search term
+    return token
+
+def parse_operator(token: str):
+    """
+    Return the normalized operator for an operator token, or None for anything else.
+    NEAR without a distance uses DEFAULT_NEAR_DISTANCE.
+    """
+    if token in ('AND', 'OR'):
+        return token
+    if token == 'NEAR':
+        return f'NEAR/{DEFAULT_NEAR_DISTANCE}'
+    if re.fullmatch(r'NEAR/\d+', token):
+        return token
+    return None
 
 def parse_boolean_query(query: str):
     """
-    Parse a boolean query with support for nested parentheses, AND, and OR operators.
+    Parse a boolean query with support for nested parentheses, AND, OR, NOT and
+    NEAR/k operators, quoted phrases and field:value terms.
     Returns a structured representation of the query.
     """
     tokens = tokenize_query(query)
@@ -27,6 +85,7 @@ def parse_boolean_query(query: str):
         """
         result = None
         current_operator = None
+        negate = False
         i = start_idx
         
         while i < len(tokens):
@@ -34,33 +93,40 @@ def parse_boolean_query(query: str):
             
             if token == '(':
                 # Parse a nested expression
-                sub_expr, next_idx = parse_expression(tokens, i + 1)
-                
-                if result is None:
-                    result = sub_expr
-                elif current_operator:
-                    result = {current_operator: [result, sub_expr]}
-                    current_operator = None
-                
-                i = next_idx
-                continue
+                operand, i = parse_expression(tokens, i + 1)
             
             elif token == ')':
                 # End of the current expression
                 return result, i + 1
             
-            elif token in ('AND', 'OR'):
-                current_operator = token
+            elif token == 'NOT':
+                negate = not negate
+                i += 1
+                continue
+            
+            elif parse_operator(token):
+                current_operator = parse_operator(token)
+                i += 1
+                continue
             
             else:
-                # Regular search term
-                if result is None:
-                    result = token
-                elif current_operator:
-                    result = {current_operator: [result, token]}
-                    current_operator = None
+                operand = parse_operand(token)
+                i += 1
+            
+            if operand is None:
+                continue
+            if negate:
+                operand = {'NOT': [operand]}
+                negate = False
             
-            i += 1
+            if result is None:
+                result = operand
+            elif current_operator:
+                result = {current_operator: [result, operand]}
+                current_operator = None
+            elif isinstance(operand, dict) and 'NOT' in operand:
+                # "a NOT b" means "a AND NOT b"
+                result = {'AND': [result, operand]}
         
         return result, i
     
@@ -72,56 +138,97 @@ def evaluate_query(query_expr, doc, exact: bool = False):
     Evaluate a parsed boolean query against a document.
     Returns True if the document matches the query, False otherwise.
     """
-    if isinstance(query_expr, str):
-        if exact:
-            return query_expr.lower() in doc.page_content.lower().split()
-        else:
-            return query_expr.lower() in doc.page_content.lower()
-    
-    if isinstance(query_expr, dict):
-        # Compound expression with AND/OR
-        operator = list(query_expr.keys())[0]
-        operands = query_expr[operator]
-        
-        if operator == 'AND':
-            return evaluate_query(operands[0], doc, exact) and evaluate_query(operands[1], doc, exact)
-        elif operator == 'OR':
-            return evaluate_query(operands[0], doc, exact) or evaluate_query(operands[1], doc, exact)
-    
-    return False
+    return compile_query(query_expr, exact).matches(normalize_document(doc))
 
-def search_knowledge_base(query: str, exact: bool = False):
+def match_query(query_expr, index: InvertedIndex, exact: bool = False) -> list[int]:
+    """
+    Evaluate a parsed boolean query against the inverted index.
+    Returns the sorted ids of all matching documents, using posting list
+    intersection/union or bitset &/| depending on how dense the terms are.
+    """
+    return match_plan(compile_query(query_expr, exact, index), index)
+
+class SearchHit:
+    """
+    A single ranked search result. The snippet is generated when the hit is produced.
+    """
+
+    def __init__(self, rank: int, document: Document, snippet: str):
+        self.rank = rank
+        self.document = document
+        self.snippet = snippet
+
+    def format(self) -> str:
+        title = self.document.metadata.get('title', 'Untitled')
+        source = self.document.metadata.get('source', 'Unknown')
+        return f"\n{self.rank}. {title} (Source: {source})\nSnippet: {self.snippet}\n\n"
+
+class SearchResults:
+    """
+    The matches of one boolean query, ranked by BM25. Matching and ranking are
+    done up front, while snippets are only generated for the hits that are
+    actually iterated or paged through.
+    """
+
+    def __init__(self, query: str, exact: bool = False, file_path: str = "knowledge_base.jsonl"):
+        self.query = query
+        self.exact = exact
+        self.index = get_search_index(file_path)
+        self.parsed_query = parse_boolean_query(query)
+        self.plan = compile_query(self.parsed_query, exact, self.index)
+        self.doc_ids = rank_matches(self.plan, self.index, match_plan(self.plan, self.index))
+
+        # Extract all search terms from the query and build one automaton for all snippets
+        self.search_terms = extract_search_terms(self.parsed_query)
+        self.automaton = AhoCorasick(self.search_terms)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return self.iter_hits()
+
+    def iter_hits(self, offset: int = 0, limit: int | None = None):
+        """
+        Lazily yield SearchHits starting at offset, at most limit of them.
+        """
+        end = len(self.doc_ids) if limit is None else min(len(self.doc_ids), offset + limit)
+        for position in range(offset, end):
+            doc_id = self.doc_ids[position]
+            yield SearchHit(position + 1, self.index.documents[doc_id], self._snippet(doc_id))
+
+    def page(self, offset: int = 0, page_size: int = 10) -> list[SearchHit]:
+        return list(self.iter_hits(offset, page_size))
+
+    def format_page(self, offset: int = 0, page_size: int | None = None) -> str:
+        return "".join(hit.format() for hit in self.iter_hits(offset, page_size))
+
+    def _snippet(self, doc_id: int) -> str:
+        # Only wait for the terms this document actually contains before finishing the snippet scan
+        present_terms = {
+            self.automaton.pattern_ids[leaf.term] for leaf in self.plan.leaves()
+            if leaf.term in self.automaton.pattern_ids and leaf.contains(doc_id, self.index)
+        }
+        return generate_snippet_with_matches(
+            self.index.documents[doc_id].page_content, self.search_terms,
+            content_lower=self.index.contents[doc_id] if self.index.contents else None,
+            automaton=self.automaton,
+            present_terms=present_terms,
+        )
+
+def search_knowledge_base(query: str, exact: bool = False, offset: int = 0, page_size: int | None = None):
     """
     Search the knowledge base for documents matching the boolean query.
-    Supports nested parentheses, AND, and OR operators.
+    Supports nested parentheses, AND, OR, NOT and NEAR/k operators, quoted
+    phrases and title:, author:, source: and date: field prefixes.
+    Returns the formatted results ranked by BM25, optionally only page_size of
+    them starting at offset.
     """
-    docs = load_docs_from_jsonl("knowledge_base.jsonl")
-    parsed_query = parse_boolean_query(query)
-    
-    matching_docs = []
-    for doc in docs:
-        if evaluate_query(parsed_query, doc, exact):
-            matching_docs.append(doc)
-    
-    print(f"Found {len(matching_docs)} matching documents")
+    results = SearchResults(query, exact)
     
-    # Extract all search terms from the query
-    all_terms = extract_search_terms(parsed_query)
-    
-    # Print the titles and a snippet containing the matched terms
-    result_string = ""
-    for i, doc in enumerate(matching_docs, 1):
-        title = doc.metadata.get('title', 'Untitled')
-        source = doc.metadata.get('source', 'Unknown')
-        
-        # Generate a snippet containing the matched terms
-        content_snippet = generate_snippet_with_matches(doc.page_content, all_terms)
-        
-        result_string += f"\n{i}. {title} (Source: {source})"
-        result_string += f"\nSnippet: {content_snippet}"
-        result_string += "\n\n"
+    print(f"Found {len(results)} matching documents")
     
-    return result_string
+    return results.format_page(offset, page_size)
 
 def extract_search_terms(parsed_query):
     """
@@ -132,6 +239,14 @@ def extract_search_terms(parsed_query):
     if isinstance(parsed_query, str):
         # Simple term
         terms.append(parsed_query.lower())
+    elif isinstance(parsed_query, dict) and ('NOT' in parsed_query or 'FIELD' in parsed_query):
+        # Excluded and metadata terms are not highlighted in content snippets
+        pass
+    elif isinstance(parsed_query, dict) and 'PHRASE' in parsed_query:
+        # Quoted phrase, followed by its words in case the phrase spans a line break
+        words = [word.lower() for word in parsed_query['PHRASE']]
+        terms.append(' '.join(words))
+        terms.extend(words)
     elif isinstance(parsed_query, dict):
         # Compound expression
         operator = list(parsed_query.keys())[0]
@@ -143,73 +258,35 @@ def extract_search_terms(parsed_query):
     
     return terms
 
-def generate_snippet_with_matches(content, search_terms, context_size=50, max_snippets=3):
+def generate_snippet_with_matches(content, search_terms, context_size=50, max_snippets=3,
+                                  content_lower=None, automaton=None, present_terms=None):
     """
     Generate snippets from the content that contain the matched search terms.
     Includes context_size characters before and after each match.
     Combines up to max_snippets different matches to provide a comprehensive view.
+    All terms are located in a single pass with an Aho-Corasick automaton; pass a
+    prebuilt automaton and the already lowercased content to reuse them across documents.
     """
-    content_lower = content.lower()
-    snippets = []
-    used_positions = set()  # Track positions we've already included in snippets
+    if content_lower is None:
+        content_lower = content.lower()
+    if automaton is None:
+        automaton = AhoCorasick([term.lower() for term in search_terms])
     
-    for term in search_terms:
-        term_lower = term.lower()
-        start_pos = 0
-        
-        # Find all occurrences of this term
-        while True:
-            start_pos = content_lower.find(term_lower, start_pos)
-            if start_pos == -1:
-                break
-                
-            # Check if this position overlaps with any existing snippet
-            overlap = False
-            for used_start, used_end in used_positions:
-                if (start_pos >= used_start and start_pos <= used_end) or \
-                   (start_pos + len(term) >= used_start and start_pos + len(term) <= used_end):
-                    overlap = True
-                    break
-            
-            if not overlap:
-                # Calculate the snippet boundaries with context
-                snippet_start = max(0, start_pos - context_size)
-                snippet_end = min(len(content), start_pos + len(term) + context_size)
-                
-                # Extract the snippet
-                if snippet_start > 0:
-                    prefix = "..."
-                else:
-                    prefix = ""
-                    
-                if snippet_end < len(content):
-                    suffix = "..."
-                else:
-                    suffix = ""
-                    
-                snippet = prefix + content[snippet_start:snippet_end] + suffix
-                snippets.append(snippet)
-                
-                # Mark this region as used - add as a tuple
-                used_positions.add((snippet_start, snippet_end))
-                
-                # If we have enough snippets, stop
-                if len(snippets) >= max_snippets:
-                    break
-            
-            # Move past this occurrence
-            start_pos += len(term)
+    windows = find_snippet_windows(content_lower, automaton, context_size, max_snippets, present_terms)
     
     # If no snippets were found (which shouldn't happen since the document matched),
     # fall back to the first 200 characters
-    if not snippets:
+    if not windows:
         return content[:200] + "..." if len(content) > 200 else content
     
+    snippets = []
+    for snippet_start, snippet_end in windows:
+        prefix = "..." if snippet_start > 0 else ""
+        suffix = "..." if snippet_end < len(content) else ""
+        snippets.append(prefix + content[snippet_start:snippet_end] + suffix)
+    
     # Combine the snippets
-    if len(snippets) == 1:
-        return snippets[0]
-    else:
-        return " | ".join(snippets)
+    return " | ".join(snippets)
 
 if __name__ == "__main__":
     query = "(viswesvara OR vishwehswara OR visweswara) AND (temple OR mandir)"
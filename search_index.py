@@ -0,0 +1,303 @@
+import bisect
+import heapq
+import math
+import re
+from collections import Counter
+import numpy as np
+from langchain_core.documents import Document
+
+NGRAM_SIZE = 3
+
+# query field prefix -> metadata key written by ingest.parse_articles
+FIELDS = {
+    'title': 'title',
+    'author': 'author',
+    'source': 'source',
+    'date': 'published_date',
+}
+
+# BM25 parameters, same defaults as rank_bm25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def tokenize_field(value) -> list[str]:
+    """
+    Split a metadata value into lowercased word tokens. Unlike page_content,
+    metadata is split on punctuation too, so dates and file names can be searched by part.
+    """
+    if value is None:
+        return []
+    return re.findall(r'\w+', str(value).lower())
+
+def character_ngrams(text: str, n: int = NGRAM_SIZE) -> set[str]:
+    """
+    Return the set of character n-grams of text.
+    """
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+class InvertedIndex:
+    """
+    Inverted index over the knowledge base documents.
+    Maps every lowercased, whitespace delimited token to a sorted posting list
+    of document ids (positions in self.documents).
+    Substring lookups are served by a character n-gram index over the token
+    vocabulary, which is built the first time it is needed.
+    Term frequencies and document lengths are kept for BM25 ranking. The token
+    positions of every posting, only needed by phrase and proximity queries,
+    are built the first time one runs, as one flat int32 array with an offsets
+    array per posting.
+    """
+
+    def __init__(self, documents: list[Document], token_lists: list[list[str]] | None = None,
+                 contents: list[str] | None = None):
+        self.documents = documents
+        # lowercased page_content of every document, when the caller already has it
+        self.contents = contents
+        self.postings: dict[str, list[int]] = {}
+        self.term_freqs: dict[str, list[int]] = {}
+        self._vocabulary: list[str] | None = None
+        self._ngram_index: dict[str, list[int]] | None = None
+        # token -> index of its first posting in _position_offsets
+        self._position_slots: dict[str, int] | None = None
+        self._position_offsets: np.ndarray | None = None
+        self._positions: np.ndarray | None = None
+
+        # kept to build the positions from; the corpus cache holds these lists anyway
+        self._token_lists = token_lists
+        if token_lists is None:
+            token_lists = [doc.page_content.lower().split() for doc in documents]
+
+        self.doc_lengths = np.zeros(len(documents), dtype=np.float64)
+        for doc_id, tokens in enumerate(token_lists):
+            self.doc_lengths[doc_id] = len(tokens)
+            for token, freq in Counter(tokens).items():
+                # doc ids are visited in increasing order, so every posting list stays sorted
+                self.postings.setdefault(token, []).append(doc_id)
+                self.term_freqs.setdefault(token, []).append(freq)
+
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(documents) else 0.0
+        self._idf_cache: dict[int, float] = {}
+        self._field_indexes: dict[str, InvertedIndex] = {}
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.documents)
+
+    def all_ids(self) -> list[int]:
+        return list(range(self.doc_count))
+
+    def field_index(self, field: str) -> "InvertedIndex":
+        """
+        Return the index over one metadata field (a key of FIELDS) of the same
+        documents, built on first use. Its doc ids are the same as this index's.
+        """
+        index = self._field_indexes.get(field)
+        if index is None:
+            key = FIELDS[field]
+            index = InvertedIndex(self.documents, [tokenize_field(doc.metadata.get(key)) for doc in self.documents])
+            self._field_indexes[field] = index
+        return index
+
+    def lookup(self, term: str) -> list[int]:
+        """
+        Return the ids of documents containing term as a whole token.
+        """
+        return self.postings.get(term.lower(), [])
+
+    def token_positions(self, token: str, doc_id: int) -> list[int]:
+        """
+        Return the sorted token positions of token in the document, empty if it does not occur.
+        """
+        postings = self.postings.get(token)
+        if not postings:
+            return []
+        i = bisect.bisect_left(postings, doc_id)
+        if i < len(postings) and postings[i] == doc_id:
+            self._build_positions()
+            slot = self._position_slots[token] + i
+            return self._positions[self._position_offsets[slot]:self._position_offsets[slot + 1]].tolist()
+        return []
+
+    def _build_positions(self):
+        """
+        Build the positions of every posting, grouped by token, then document.
+        Sorting the (token id, position) pairs of all documents by token id with
+        a stable sort yields exactly that order, since documents and positions
+        are already visited in increasing order.
+        """
+        if self._positions is not None:
+            return
+        token_lists = self._token_lists
+        if token_lists is None:
+            token_lists = [doc.page_content.lower().split() for doc in self.documents]
+        token_ids = {token: token_id for token_id, token in enumerate(self.postings)}
+        all_token_ids = np.fromiter(
+            (token_ids[token] for tokens in token_lists for token in tokens), dtype=np.int32, count=sum(map(len, token_lists)),
+        )
+        all_positions = np.concatenate(
+            [np.arange(len(tokens), dtype=np.int32) for tokens in token_lists] or [np.zeros(0, dtype=np.int32)]
+        )
+        positions = all_positions[np.argsort(all_token_ids, kind='stable')]
+
+        slots = {}
+        freqs = []
+        for token, token_freqs in self.term_freqs.items():
+            slots[token] = len(freqs)
+            freqs.extend(token_freqs)
+        offsets = np.zeros(len(freqs) + 1, dtype=np.int64)
+        np.cumsum(freqs, out=offsets[1:])
+
+        self._position_slots = slots
+        self._position_offsets = offsets
+        # assigned last, as the flag that the other two are ready
+        self._positions = positions
+
+    def term_matches(self, tokens: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the concatenated (doc ids, term frequencies) of the given vocabulary tokens.
+        """
+        tokens = [token for token in tokens if token in self.postings]
+        if not tokens:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        doc_ids = np.concatenate([np.asarray(self.postings[token], dtype=np.int64) for token in tokens])
+        freqs = np.concatenate([np.asarray(self.term_freqs[token], dtype=np.float64) for token in tokens])
+        return doc_ids, freqs
+
+    def idf(self, doc_freq: int) -> float:
+        """
+        BM25 inverse document frequency, using the non-negative variant of the formula.
+        """
+        idf = self._idf_cache.get(doc_freq)
+        if idf is None:
+            idf = math.log(1 + (self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+            self._idf_cache[doc_freq] = idf
+        return idf
+
+    def bm25_scores(self, doc_ids: list[int], terms: list[tuple[np.ndarray, np.ndarray, int]]) -> np.ndarray:
+        """
+        Score the sorted doc_ids with BM25.
+        Each term is given as (doc ids, term frequencies, document frequency), as
+        returned by term_matches; postings outside doc_ids are ignored.
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        scores = np.zeros(len(doc_ids), dtype=np.float64)
+        if not len(doc_ids) or not self.avg_doc_length:
+            return scores
+
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_ids] / self.avg_doc_length)
+        for term_doc_ids, term_freqs, doc_freq in terms:
+            if not len(term_doc_ids):
+                continue
+            positions = np.searchsorted(doc_ids, term_doc_ids)
+            valid = positions < len(doc_ids)
+            valid[valid] = doc_ids[positions[valid]] == term_doc_ids[valid]
+            tf = np.zeros(len(doc_ids), dtype=np.float64)
+            np.add.at(tf, positions[valid], term_freqs[valid])
+            scores += self.idf(doc_freq) * tf * (BM25_K1 + 1) / (tf + length_norm)
+        return scores
+
+    def lookup_substring(self, term: str) -> list[int]:
+        """
+        Return the ids of documents containing term anywhere in their content.
+        A term without whitespace can only occur inside a single token, so it is
+        enough to find the matching vocabulary tokens instead of scanning documents.
+        """
+        term = term.lower()
+        return union_postings([self.postings[token] for token in self.tokens_containing(term)])
+
+    def tokens_containing(self, term: str) -> list[str]:
+        """
+        Return the vocabulary tokens that contain term.
+        Candidate tokens come from intersecting the n-gram lists of term and are
+        verified with a substring test. Terms shorter than an n-gram fall back
+        to scanning the vocabulary.
+        """
+        self._build_ngram_index()
+
+        if len(term) < NGRAM_SIZE:
+            return [token for token in self._vocabulary if term in token]
+
+        candidates = None
+        for ngram in sorted(character_ngrams(term), key=lambda g: len(self._ngram_index.get(g, ()))):
+            token_ids = self._ngram_index.get(ngram)
+            if not token_ids:
+                return []
+            candidates = token_ids if candidates is None else intersect_postings(candidates, token_ids)
+            if not candidates:
+                return []
+
+        vocabulary = self._vocabulary
+        return [vocabulary[token_id] for token_id in candidates if term in vocabulary[token_id]]
+
+    def _build_ngram_index(self):
+        """
+        Build the n-gram -> sorted token id index over the vocabulary.
+        """
+        if self._ngram_index is not None:
+            return
+        vocabulary = list(self.postings)
+        ngram_index: dict[str, list[int]] = {}
+        for token_id, token in enumerate(vocabulary):
+            for ngram in character_ngrams(token):
+                ngram_index.setdefault(ngram, []).append(token_id)
+        self._vocabulary = vocabulary
+        self._ngram_index = ngram_index
+
+def intersect_postings(left: list[int], right: list[int]) -> list[int]:
+    """
+    Intersect two sorted posting lists.
+    Uses binary search into the longer list when the lengths are very different,
+    otherwise a linear merge.
+    """
+    if len(left) > len(right):
+        left, right = right, left
+    if not left:
+        return []
+
+    result = []
+    if len(left) * 8 < len(right):
+        lo = 0
+        for doc_id in left:
+            lo = bisect.bisect_left(right, doc_id, lo)
+            if lo == len(right):
+                break
+            if right[lo] == doc_id:
+                result.append(doc_id)
+        return result
+
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] == right[j]:
+            result.append(left[i])
+            i += 1
+            j += 1
+        elif left[i] < right[j]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def difference_postings(left: list[int], right: list[int]) -> list[int]:
+    """
+    Return the ids of the sorted posting list left that are not in right.
+    """
+    if not right:
+        return list(left)
+    excluded = set(right)
+    return [doc_id for doc_id in left if doc_id not in excluded]
+
+def union_postings(posting_lists: list[list[int]]) -> list[int]:
+    """
+    Merge any number of sorted posting lists into one sorted list without duplicates.
+    """
+    posting_lists = [postings for postings in posting_lists if postings]
+    if not posting_lists:
+        return []
+    if len(posting_lists) == 1:
+        return list(posting_lists[0])
+
+    result = []
+    for doc_id in heapq.merge(*posting_lists):
+        if not result or result[-1] != doc_id:
+            result.append(doc_id)
+    return result
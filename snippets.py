@@ -0,0 +1,116 @@
+from collections import deque
+
+class AhoCorasick:
+    """
+    Multi-pattern matching automaton.
+    Finds every occurrence of every pattern in a single pass over the text.
+    """
+
+    def __init__(self, patterns: list[str]):
+        self.patterns = list(dict.fromkeys(pattern for pattern in patterns if pattern))
+        self.pattern_ids = {pattern: pattern_id for pattern_id, pattern in enumerate(self.patterns)}
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.output: list[list[int]] = [[]]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(pattern_id)
+
+        # breadth first so every fail target is finished before it is used
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def finditer(self, text: str):
+        """
+        Yield (start, end, pattern_id) for every match, ordered by end position.
+        """
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        root = goto[0]
+        state = 0
+        for i, char in enumerate(text):
+            if state == 0:
+                state = root.get(char, 0)
+                if state == 0:
+                    continue
+            else:
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+            for pattern_id in output[state]:
+                yield i + 1 - len(patterns[pattern_id]), i + 1, pattern_id
+
+def find_snippet_windows(text: str, automaton: AhoCorasick, context_size: int = 50, max_snippets: int = 3,
+                         expected_patterns: set[int] | None = None) -> list[tuple[int, int]]:
+    """
+    Return up to max_snippets non-overlapping (start, end) windows around matches in text.
+    Overlapping match windows are merged (up to a bounded width). The scan stops
+    as soon as enough windows are found and every expected pattern (by default
+    all of them) has been seen, and the chosen windows cover as many different
+    patterns as possible.
+    """
+    max_width = 4 * context_size + max((len(p) for p in automaton.patterns), default=0)
+    windows: list[list] = []  # [start, end, pattern ids], sorted and disjoint
+    unseen = set(range(len(automaton.patterns)) if expected_patterns is None else expected_patterns)
+
+    for start, end, pattern_id in automaton.finditer(text):
+        window_start = max(0, start - context_size)
+        window_end = min(len(text), end + context_size)
+
+        if windows and window_start <= windows[-1][1]:
+            last = windows[-1]
+            if max(window_end, last[1]) - min(window_start, last[0]) <= max_width:
+                last[0] = min(last[0], window_start)
+                last[1] = max(last[1], window_end)
+                last[2].add(pattern_id)
+                while len(windows) > 1 and windows[-2][1] >= last[0]:
+                    previous = windows.pop(-2)
+                    last[0] = min(last[0], previous[0])
+                    last[2] |= previous[2]
+                unseen.discard(pattern_id)
+                continue
+            if start < last[1]:
+                # the match is already visible in the last window, which is as wide as allowed
+                last[2].add(pattern_id)
+                unseen.discard(pattern_id)
+                continue
+            window_start = last[1]
+
+        if len(windows) >= max_snippets and not unseen:
+            break
+        windows.append([window_start, window_end, {pattern_id}])
+        unseen.discard(pattern_id)
+
+    # prefer the first window of every pattern, then fill up in text order
+    chosen = []
+    for pattern_id in range(len(automaton.patterns)):
+        for window in windows:
+            if pattern_id in window[2]:
+                if window not in chosen and len(chosen) < max_snippets:
+                    chosen.append(window)
+                break
+    for window in windows:
+        if len(chosen) >= max_snippets:
+            break
+        if window not in chosen:
+            chosen.append(window)
+
+    return sorted((window[0], window[1]) for window in chosen)
@@ -10,11 +10,19 @@ from langchain_core.tools import tool
 from langsmith import traceable
 from pydantic import BaseModel, Field
 
-from retrievers import format_docs, deduplicate_docs, load_vector_store, FuzzyMatchRetriever, load_docs_from_jsonl, HybridRetriever
+from retrievers import format_docs, deduplicate_docs, load_vector_store, FuzzyMatchRetriever, HybridRetriever
+from corpus_cache import get_corpus
+from query_cache import CachedRetriever, QueryResultCache
 
-fuzzy_retriever = FuzzyMatchRetriever(documents=load_docs_from_jsonl("knowledge_base.jsonl"), k=5)
+corpus = get_corpus("knowledge_base.jsonl")
+fuzzy_retriever = FuzzyMatchRetriever(documents=corpus.documents, k=5, cache_dir=".cache/fuzzy", cache_key=corpus.version)
 vector_db_retriever = load_vector_store().as_retriever(search_type="mmr",search_kwargs={"k": 5, "fetch_k": 20})
-retriever = HybridRetriever(fuzzy_retriever=fuzzy_retriever, vector_db_retriever=vector_db_retriever)
+hybrid_retriever = HybridRetriever(fuzzy_retriever=fuzzy_retriever, vector_db_retriever=vector_db_retriever, fusion="rrf", max_docs=8)
+retriever = CachedRetriever(
+    retriever=hybrid_retriever,
+    cache=QueryResultCache(max_entries=2048, path=".cache/query_results.sqlite"),
+    corpus_version=corpus.version,
+)
 
 @tool
 @cl.step(name="knowledge base search engine")
@@ -28,7 +36,8 @@ async def search_knowledge_base(research_query: str) -> str:
     queries = await generate_search_queries(research_query)
 
     # search the knowledge base
-    docs = retriever.batch(queries)
+    docs = await retriever.abatch(queries)
+    logging.info(f"query cache: {retriever.cache.stats()}")
     docs = deduplicate_docs(docs)
 
     #contextual compression
@@ -82,7 +91,8 @@ The query is: {query}
     contextualized_docs = []
     for compressed_doc, doc in zip(compressed_docs, docs):
         if compressed_doc and compressed_doc.passages_in_context:
-            doc.page_content = f"Here are the relevant passages from this document: {'\n'.join(compressed_doc.passages_in_context)}"
+            # copy, the retrieved document is shared with the retriever's caches
+            doc = doc.model_copy(update={"page_content": f"Here are the relevant passages from this document: {'\n'.join(compressed_doc.passages_in_context)}"})
             contextualized_docs.append(doc)
     logging.info(f"number of contextualized docs: {len(contextualized_docs)}")
     return contextualized_docs
@@ -0,0 +1,62 @@
+import unittest
+from chunking import PAGE_DELIMITER, chunk_documents
+from retrievers import Document, get_doc_id
+
+class WordTokenizer:
+    """Stands in for tiktoken: one token per word, recording how it is called."""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode_batch(self, texts):
+        self.batches.append(len(texts))
+        return [text.split() for text in texts]
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+def paragraph(name, words):
+    return ' '.join(f"{name}{i}" for i in range(words))
+
+def long_article():
+    pages = [
+        paragraph("a", 30) + "\n\n" + paragraph("b", 30),
+        paragraph("c", 30) + "\n\n" + paragraph("d", 10),
+        paragraph("e", 30),
+    ]
+    content = f"\n{PAGE_DELIMITER}\n".join(pages)
+    return Document(page_content=content, metadata={"title": "Long", "source": "2024-01.txt", "start_page": 5, "end_page": 7})
+
+class TestChunking(unittest.TestCase):
+    def test_short_articles_are_unchanged(self):
+        doc = Document(page_content="a short article", metadata={"title": "Short", "source": "2024-01.txt"})
+        self.assertEqual(chunk_documents([doc], WordTokenizer(), max_tokens=50, min_article_tokens=0), [doc])
+
+    def test_articles_below_the_old_limit_stay_whole(self):
+        # these were ingested whole before chunking, so their ids must not change
+        tokenizer = WordTokenizer()
+        self.assertEqual(chunk_documents([long_article()], tokenizer, max_tokens=65, min_article_tokens=200), [long_article()])
+        self.assertEqual(tokenizer.batches, [1])
+
+    def test_long_articles_are_split_on_boundaries(self):
+        tokenizer = WordTokenizer()
+        chunks = chunk_documents([long_article()], tokenizer, max_tokens=65, overlap_tokens=15, min_article_tokens=0)
+        self.assertEqual(tokenizer.batches, [1, 5])
+        self.assertEqual([chunk.page_content.split()[0] for chunk in chunks], ["a0", "c0", "d0"])
+        self.assertTrue(all(len(chunk.page_content.split()) <= 65 for chunk in chunks))
+        # the small paragraph d is repeated as overlap
+        self.assertIn("d0", chunks[1].page_content)
+        self.assertEqual([(chunk.metadata["start_page"], chunk.metadata["end_page"]) for chunk in chunks], [(5, 5), (6, 6), (6, 7)])
+        self.assertTrue(all(chunk.metadata["parent_id"] == "2024-01.txt-Long" for chunk in chunks))
+        self.assertEqual([get_doc_id(chunk) for chunk in chunks], [f"2024-01.txt-Long-{i}" for i in range(3)])
+        self.assertEqual(chunks[0].metadata["chunk_count"], 3)
+
+    def test_oversized_paragraphs_are_split(self):
+        doc = Document(page_content=paragraph("x", 25) + "\n" + paragraph("y", 100), metadata={"title": "T", "source": "s.txt"})
+        chunks = chunk_documents([doc], WordTokenizer(), max_tokens=40, overlap_tokens=0, min_article_tokens=0)
+        words = [word for chunk in chunks for word in chunk.page_content.split()]
+        self.assertEqual(words, paragraph("x", 25).split() + paragraph("y", 100).split())
+        self.assertTrue(all(len(chunk.page_content.split()) <= 40 for chunk in chunks))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+from corpus_cache import CorpusCache
+from retrievers import Document
+
+def write_jsonl(path, docs):
+    with open(path, 'w') as f:
+        for doc in docs:
+            f.write(doc.model_dump_json() + '\n')
+
+class TestCorpusCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "knowledge_base.jsonl")
+        write_jsonl(self.path, [Document(page_content="Swami AND Temple", metadata={"title": "a", "source": "a.txt"})])
+        self.cache = CorpusCache()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_loads_once(self):
+        corpus = self.cache.get(self.path)
+        self.assertEqual(corpus.contents, ["swami and temple"])
+        self.assertEqual(corpus.tokens, [["swami", "and", "temple"]])
+        self.assertIs(self.cache.get(self.path), corpus)
+
+    def test_reloads_on_change(self):
+        corpus = self.cache.get(self.path)
+        write_jsonl(self.path, [
+            Document(page_content="Swami AND Temple", metadata={"title": "a", "source": "a.txt"}),
+            Document(page_content="mandir", metadata={"title": "b", "source": "b.txt"}),
+        ])
+        reloaded = self.cache.get(self.path)
+        self.assertIsNot(reloaded, corpus)
+        self.assertEqual(len(reloaded), 2)
+        self.assertNotEqual(reloaded.version, corpus.version)
+
+    def test_touch_without_change_keeps_corpus(self):
+        corpus = self.cache.get(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertIs(self.cache.get(self.path), corpus)
+
+if __name__ == "__main__":
+    unittest.main()
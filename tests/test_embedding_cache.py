@@ -0,0 +1,72 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from embedding_cache import CachedEmbeddings
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Fake embedder that records every text it is asked to embed."""
+    embedded: list = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return super().embed_query(text)
+
+class TestCachedEmbeddings(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "cache", "embeddings.sqlite")
+        self.fake = CountingEmbedding(size=16, embedded=[])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_documents_are_embedded_once(self):
+        embeddings = CachedEmbeddings(self.fake, self.path)
+        first = embeddings.embed_documents(["swami", "temple", "swami"])
+        self.assertEqual(self.fake.embedded, ["swami", "temple"])
+        np.testing.assert_allclose(first[0], self.fake.embed_documents(["swami"])[0], rtol=1e-6)
+        self.fake.embedded.clear()
+
+        # a new process reads the same file
+        second = CachedEmbeddings(self.fake, self.path).embed_documents(["temple", "mandir"])
+        self.assertEqual(self.fake.embedded, ["mandir"])
+        self.assertEqual(second[0], first[1])
+        self.assertEqual(embeddings.stats()['hits'], 1)
+
+    def test_queries_are_cached_separately(self):
+        embeddings = CachedEmbeddings(self.fake, self.path)
+        embeddings.embed_documents(["swami"])
+        embeddings.embed_query("swami")
+        asyncio.run(embeddings.aembed_query("swami"))
+        self.assertEqual(self.fake.embedded, ["swami", "swami"])
+
+    def test_async_methods_keep_sqlite_off_the_event_loop(self):
+        embeddings = CachedEmbeddings(self.fake, self.path)
+        threads = []
+        connect = embeddings._connect
+
+        def record_thread():
+            threads.append(threading.current_thread())
+            return connect()
+
+        embeddings._connect = record_thread
+        asyncio.run(embeddings.aembed_documents(["swami"]))
+        asyncio.run(embeddings.aembed_query("swami"))
+        self.assertEqual(len(threads), 4)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    def test_namespaces_do_not_mix(self):
+        CachedEmbeddings(self.fake, self.path, namespace="a").embed_documents(["swami"])
+        CachedEmbeddings(self.fake, self.path, namespace="b").embed_documents(["swami"])
+        self.assertEqual(self.fake.embedded, ["swami", "swami"])
+
+if __name__ == "__main__":
+    unittest.main()
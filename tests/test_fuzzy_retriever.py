@@ -0,0 +1,132 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import unittest
+from rapidfuzz import fuzz
+from metaphone import doublemetaphone
+from retrievers import Document, FuzzyMatchRetriever
+from fuzzy_cache import CACHE_FORMAT_VERSION
+from phonetic import PhoneticEncoder
+
+WORDS = ["seva", "math", "bhajan", "festival", "community", "youth", "camp", "library", "music",
+         "class", "sabha", "pooja", "donation", "report", "village", "school", "health", "yoga"]
+
+def make_corpus(n_docs=200, seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n_docs):
+        content = " ".join(rng.choice(WORDS) for _ in range(60))
+        docs.append(Document(page_content=content, metadata={"title": f"Report {i}", "source": f"{i}.txt"}))
+    docs[17].page_content += " Parijnanashram Swamiji visited Shirali"
+    docs[42].page_content += " Swami Parijnanashram blessed the devotees"
+    docs[99].metadata["title"] = "Vishweshwara temple renovation"
+    return docs
+
+class TestFuzzyMatchRetriever(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.docs = make_corpus()
+        cls.full = FuzzyMatchRetriever(documents=cls.docs, k=5, candidate_limit=None)
+        cls.filtered = FuzzyMatchRetriever(documents=cls.docs, k=5, candidate_limit=20)
+
+    def test_candidates_keep_relevant_documents(self):
+        query_tokens = {"parijnanashram", "swamiji"}
+        candidates = self.filtered._candidate_indices(query_tokens, "PRJN SMJ")
+        self.assertLessEqual(len(candidates), 20)
+        self.assertIn(17, candidates)
+        self.assertIn(42, candidates)
+
+    def test_spelling_variants_become_candidates(self):
+        candidates = self.filtered._candidate_indices({"visweshwara"}, "FSXR")
+        self.assertIn(99, candidates)
+
+    def test_filtered_results_match_full_scan(self):
+        for query in ["Parijnanashram Swamiji", "swami parijnanashram", "shirali"]:
+            expected = [doc.metadata["source"] for doc in self.full.invoke(query)]
+            actual = [doc.metadata["source"] for doc in self.filtered.invoke(query)]
+            self.assertTrue(expected)
+            self.assertEqual(actual, expected, query)
+
+    def test_batch_matches_individual_queries(self):
+        queries = ["Parijnanashram Swamiji", "seva camp", "bhajn festivl", "shirali"]
+        for retriever in (self.full, self.filtered):
+            batched = retriever.batch(queries)
+            self.assertEqual(batched, [retriever.invoke(query) for query in queries])
+
+    def test_top_k_matches_full_sort(self):
+        retriever = self.full
+        for query in ["seva camp", "bhajn festivl", "yoga class report"]:
+            query_lower = query.lower()
+            tokens = set(query_lower.split())
+            phonetic = ' '.join(doublemetaphone(word)[0] for word in query_lower.split())
+            scored = []
+            for doc_data in retriever._doc_cache:
+                token_overlap = len(tokens & set(doc_data.content.split())) / len(tokens) * 100
+                phonetic_score = fuzz.token_set_ratio(phonetic, doc_data.content_phonetic)
+                metadata_ratio = max(
+                    [fuzz.ratio(query_lower, value) for value in doc_data.metadata.values()] +
+                    [fuzz.token_set_ratio(phonetic, value) for value in doc_data.metadata_phonetic.values()]
+                )
+                content_score = (fuzz.partial_ratio(query_lower, doc_data.content) + token_overlap + phonetic_score) / 3
+                ratio = retriever.content_weight * content_score + retriever.metadata_weight * metadata_ratio
+                if ratio > retriever.threshold:
+                    scored.append(((phonetic_score, token_overlap, ratio), doc_data.document))
+            scored.sort(key=lambda x: x[0], reverse=True)
+            self.assertEqual(retriever.invoke(query), [doc for _, doc in scored[:retriever.k]], query)
+
+    def test_cached_retriever_matches_fresh_build(self):
+        queries = ["Parijnanashram Swamiji", "visweshwara", "bhajn festivl"]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first = FuzzyMatchRetriever(documents=self.docs, k=5, candidate_limit=20, cache_dir=cache_dir)
+            second = FuzzyMatchRetriever(documents=self.docs, k=5, candidate_limit=20, cache_dir=cache_dir)
+            self.assertIsInstance(first._doc_cache.contents.buffer, bytes)
+            self.assertNotIsInstance(second._doc_cache.contents.buffer, bytes)
+            self.assertEqual(second.batch(queries), self.filtered.batch(queries))
+            self.assertEqual(second.invoke("shirali"), self.filtered.invoke("shirali"))
+
+    def test_cache_of_the_previous_corpus_is_pruned(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            FuzzyMatchRetriever(documents=self.docs[:20], k=5, cache_dir=cache_dir, cache_key="old")
+            FuzzyMatchRetriever(documents=self.docs[:30], k=5, cache_dir=cache_dir, cache_key="new")
+            self.assertEqual(os.listdir(cache_dir), [f"new-v{CACHE_FORMAT_VERSION}"])
+
+    def test_phonetic_codes_are_memoized(self):
+        retriever = FuzzyMatchRetriever(documents=self.docs[:50], k=5)
+        stats = retriever.phonetic_stats()
+        self.assertEqual(stats['misses'], stats['vocabulary_words'])
+        self.assertGreater(stats['hit_rate'], 0.9)
+        for doc_data in list(retriever._doc_cache)[:5]:
+            expected = ' '.join(doublemetaphone(word)[0] for word in doc_data.content.split())
+            self.assertEqual(doc_data.content_phonetic, expected)
+
+    def test_memory_report(self):
+        report = self.full.memory_report()
+        self.assertEqual(report['total'], sum(value for name, value in report.items() if name != 'total'))
+        self.assertGreaterEqual(report['contents'], sum(len(doc.page_content) for doc in self.docs))
+
+class TestPhoneticEncoder(unittest.TestCase):
+    def test_query_words_are_bounded_lru(self):
+        encoder = PhoneticEncoder({"swami": doublemetaphone("swami")[0]}, max_query_words=2)
+        self.assertEqual(encoder.encode_text("swami temple mandir"), ' '.join(doublemetaphone(w)[0] for w in ["swami", "temple", "mandir"]))
+        self.assertEqual(encoder.stats()['hits'], 1)
+        encoder.encode("mandir")
+        encoder.encode("shirali")
+        self.assertEqual(list(encoder._query_codes), ["mandir", "shirali"])
+        self.assertEqual(len(encoder.vocabulary_codes), 1)
+        self.assertEqual(encoder.stats()['misses'], 3)
+
+    def test_concurrent_encoding_with_a_full_lru(self):
+        encoder = PhoneticEncoder(max_query_words=4)
+        words = [f"{word}{i}" for word in WORDS for i in range(5)]
+
+        def encode_all(offset):
+            return [encoder.encode(word) for word in words[offset:] + words[:offset]]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(encode_all, range(0, len(words), 7)))
+        self.assertTrue(all(sorted(codes) == sorted(doublemetaphone(word)[0] for word in words) for codes in results))
+        self.assertLessEqual(len(encoder._query_codes), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import asyncio
+import time
+import unittest
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from retrievers import Document, FuzzyMatchRetriever, HybridRetriever, deduplicate_docs, reciprocal_rank_fusion
+from test_fuzzy_retriever import make_corpus
+
+class SlowVectorRetriever(BaseRetriever):
+    """Stands in for the Pinecone retriever: returns a fixed document per query after a delay."""
+    delay: float = 0.0
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        time.sleep(self.delay)
+        return [Document(page_content=f"vector {query}", metadata={"title": query, "source": "vector.txt"})]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        await asyncio.sleep(self.delay)
+        return [Document(page_content=f"vector {query}", metadata={"title": query, "source": "vector.txt"})]
+
+class RetrieverRunRecorder(BaseCallbackHandler):
+    """Records the retriever runs reported to callbacks as (name, query, parent run id)."""
+
+    def __init__(self):
+        self.runs = {}
+        self.ended = []
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self.runs[run_id] = (kwargs.get("name"), query, parent_run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self.ended.append(run_id)
+
+class TestHybridRetriever(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fuzzy = FuzzyMatchRetriever(documents=make_corpus(), k=3)
+
+    def test_async_matches_sync(self):
+        retriever = HybridRetriever(fuzzy_retriever=self.fuzzy, vector_db_retriever=SlowVectorRetriever())
+        queries = ["Parijnanashram Swamiji", "seva camp"]
+        self.assertEqual(asyncio.run(retriever.ainvoke(queries[0])), retriever.invoke(queries[0]))
+        self.assertEqual(asyncio.run(retriever.abatch(queries)), retriever.batch(queries))
+
+    def test_branches_run_concurrently(self):
+        retriever = HybridRetriever(fuzzy_retriever=self.fuzzy, vector_db_retriever=SlowVectorRetriever(delay=0.3))
+
+        async def run():
+            ticks = 0
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+            task = asyncio.create_task(ticker())
+            docs = await retriever.ainvoke("seva camp")
+            task.cancel()
+            return docs, ticks
+
+        docs, ticks = asyncio.run(run())
+        self.assertEqual(docs[-1].page_content, "vector seva camp")
+        # the event loop kept running while both branches were in flight
+        self.assertGreater(ticks, 10)
+
+    def test_vector_timeout_keeps_fuzzy_results(self):
+        retriever = HybridRetriever(
+            fuzzy_retriever=self.fuzzy, vector_db_retriever=SlowVectorRetriever(delay=5), vector_timeout=0.05,
+        )
+        start = time.perf_counter()
+        with self.assertLogs(level="WARNING"):
+            results = asyncio.run(retriever.abatch(["Parijnanashram Swamiji", "shirali"]))
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertEqual(results, self.fuzzy.batch(["Parijnanashram Swamiji", "shirali"]))
+
+    def test_rrf_merges_duplicates_and_caps(self):
+        fuzzy_docs = self.fuzzy.invoke("Parijnanashram Swamiji")
+        # the vector store returns its own copy of a fuzzy hit, with cleaned metadata
+        copy = Document(page_content=fuzzy_docs[1].page_content, metadata=dict(fuzzy_docs[1].metadata, year="Unknown"))
+
+        class FixedRetriever(SlowVectorRetriever):
+            def _get_relevant_documents(self, query, *, run_manager):
+                return [copy, Document(page_content="other", metadata={"title": "other", "source": "other.txt"})]
+
+        retriever = HybridRetriever(
+            fuzzy_retriever=self.fuzzy, vector_db_retriever=FixedRetriever(), fusion="rrf", max_docs=3,
+        )
+        docs = retriever.invoke("Parijnanashram Swamiji")
+        self.assertEqual(len(docs), 3)
+        # found by both branches, so it outranks everything found by one
+        self.assertIs(docs[0], fuzzy_docs[1])
+
+    def test_batches_are_traced_per_query(self):
+        retriever = HybridRetriever(fuzzy_retriever=self.fuzzy, vector_db_retriever=SlowVectorRetriever())
+        queries = ["seva camp", "shirali"]
+        for run in (lambda config: retriever.batch(queries, config), lambda config: asyncio.run(retriever.abatch(queries, config))):
+            recorder = RetrieverRunRecorder()
+            run({"callbacks": [recorder]})
+            top = {run_id: query for run_id, (_, query, parent) in recorder.runs.items() if parent is None}
+            self.assertEqual(sorted(top.values()), sorted(queries))
+            # the fuzzy and vector runs of each query are children of its hybrid run
+            children = [(name, query, top[parent]) for name, query, parent in recorder.runs.values() if parent is not None]
+            self.assertEqual(len(children), 4)
+            self.assertTrue(all(query == parent_query for _, query, parent_query in children))
+            self.assertEqual(len(recorder.ended), 6)
+
+    def test_batch_return_exceptions(self):
+        class FailingRetriever(SlowVectorRetriever):
+            def _get_relevant_documents(self, query, *, run_manager):
+                raise ValueError(query)
+
+        retriever = HybridRetriever(fuzzy_retriever=self.fuzzy, vector_db_retriever=FailingRetriever())
+        results = retriever.batch(["seva camp", "shirali"], return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        with self.assertRaises(ValueError):
+            retriever.batch(["seva camp"])
+
+class TestFusion(unittest.TestCase):
+    def test_reciprocal_rank_fusion(self):
+        a, b, c = (Document(page_content=name, metadata={"title": name, "source": f"{name}.txt"}) for name in "abc")
+        self.assertEqual(reciprocal_rank_fusion([[a, b], [c, b]]), [b, a, c])
+        self.assertEqual(reciprocal_rank_fusion([[a, b], [c]]), [a, c, b])
+        self.assertEqual(reciprocal_rank_fusion([[a, b], [c]], weights=[1.0, 3.0]), [c, a, b])
+        self.assertEqual(reciprocal_rank_fusion([[a, b], [c, b]], limit=1), [b])
+
+    def test_deduplicate_docs_keys_on_doc_id(self):
+        doc = Document(page_content="text", metadata={"title": "t", "source": "s.txt"})
+        cleaned = Document(page_content="text", metadata={"title": "t", "source": "s.txt", "year": "Unknown"})
+        self.assertEqual(deduplicate_docs([[doc], [cleaned]]), [doc])
+
+    def test_chunk_copies_from_the_vector_store_are_merged(self):
+        chunk = Document(page_content="text", metadata={"title": "t", "source": "s.txt", "chunk_index": 0})
+        # Pinecone hands numbers back as floats
+        vector_copy = Document(page_content="text", metadata={"title": "t", "source": "s.txt", "chunk_index": 0.0})
+        self.assertEqual(deduplicate_docs([[chunk], [vector_copy]]), [chunk])
+        self.assertEqual(reciprocal_rank_fusion([[chunk], [vector_copy]]), [chunk])
+
+if __name__ == "__main__":
+    unittest.main()
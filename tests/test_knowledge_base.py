@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from knowledge_base import KnowledgeBaseStore, read_records
+from retrievers import Document, get_doc_id, load_docs_from_jsonl, save_docs_to_jsonl
+
+def article(title, content, source="issue.txt"):
+    return Document(page_content=content, metadata={"title": title, "source": source})
+
+class TestKnowledgeBaseStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "knowledge_base.jsonl")
+        self.store = KnowledgeBaseStore(self.path, key=get_doc_id)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_lines(self):
+        with open(self.path) as f:
+            return f.readlines()
+
+    def test_append_only_writes_new_and_changed(self):
+        self.assertEqual(self.store.append([article("a", "one"), article("b", "two")]), 2)
+        self.assertEqual(self.store.append([article("a", "one"), article("b", "two, corrected"), article("c", "three")]), 2)
+        self.assertEqual(len(self.read_lines()), 4)
+        docs = load_docs_from_jsonl(self.path)
+        # the update keeps the document's original position
+        self.assertEqual([doc.page_content for doc in docs], ["one", "two, corrected", "three"])
+        self.assertEqual(self.store.documents(), docs)
+
+    def test_compaction_drops_superseded_records(self):
+        self.store.append([article("a", "one"), article("b", "two")])
+        self.store.append([article("a", "one!"), article("b", "two!")])
+        self.assertTrue(self.store.needs_compaction())
+        before = load_docs_from_jsonl(self.path)
+        thread = self.store.compact_in_background()
+        thread.join()
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual(load_docs_from_jsonl(self.path), before)
+        self.assertFalse(self.store.needs_compaction())
+        # the index stays valid after compaction
+        self.assertEqual(self.store.append([article("a", "one!")]), 0)
+
+    def test_partial_trailing_record(self):
+        self.store.append([article("a", "one")])
+        with open(self.path, 'a') as f:
+            f.write('{"page_content": "half wri')
+        self.assertEqual([doc.page_content for doc in load_docs_from_jsonl(self.path)], ["one"])
+        # the next writer drops the partial record before appending
+        KnowledgeBaseStore(self.path, key=get_doc_id).append([article("b", "two")])
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual([doc.page_content for doc in load_docs_from_jsonl(self.path)], ["one", "two"])
+
+    def test_deleted_documents_stay_deleted(self):
+        self.store.append([article("a", "one"), article("b", "two"), article("c", "three")])
+        self.assertEqual(self.store.delete(["issue.txt-b", "issue.txt-missing"]), 1)
+        self.assertNotIn("issue.txt-b", self.store)
+        self.assertEqual([doc.page_content for doc in load_docs_from_jsonl(self.path)], ["one", "three"])
+        # a fresh reader replays the tombstone from the file and the sidecar
+        reader = KnowledgeBaseStore(self.path, key=get_doc_id)
+        self.assertIsNone(reader.get("issue.txt-b"))
+        self.assertEqual([doc.page_content for doc in reader.get_by_source("issue.txt")], ["one", "three"])
+        self.assertEqual(len(self.read_lines()), 4)
+        self.store.compact()
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual([doc.page_content for doc in reader.documents()], ["one", "three"])
+        # a deleted document can come back, at the end
+        self.store.append([article("b", "two again")])
+        self.assertEqual([doc.page_content for doc in load_docs_from_jsonl(self.path)], ["one", "three", "two again"])
+
+    def test_save_docs_to_jsonl_merges(self):
+        save_docs_to_jsonl([article("a", "one"), article("b", "two")], self.path)
+        save_docs_to_jsonl([article("b", "two!")], self.path)
+        self.assertEqual([doc.page_content for doc in load_docs_from_jsonl(self.path)], ["one", "two!"])
+
+class TestKnowledgeBaseIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "knowledge_base.jsonl")
+        KnowledgeBaseStore(self.path, key=get_doc_id).append([
+            article("a", "one", "2024-01.txt"), article("b", "two", "2024-01.txt"), article("c", "three", "2024-02.txt"),
+        ])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_by_id_and_source(self):
+        store = KnowledgeBaseStore(self.path, key=get_doc_id)
+        self.assertEqual(store.get("2024-01.txt-b").page_content, "two")
+        self.assertIsNone(store.get("2024-01.txt-z"))
+        self.assertIn("2024-02.txt-c", store)
+        self.assertEqual([doc.page_content for doc in store.get_by_source("2024-01.txt")], ["one", "two"])
+        self.assertEqual(store.sources(), {"2024-01.txt", "2024-02.txt"})
+
+    def test_sidecar_is_reused_and_extended(self):
+        self.assertTrue(os.path.exists(self.path + ".idx"))
+        # a record appended by something that did not update the sidecar
+        with open(self.path, 'a') as f:
+            f.write(article("b", "two, corrected", "2024-01.txt").model_dump_json() + "\n")
+        store = KnowledgeBaseStore(self.path, key=get_doc_id)
+        with mock.patch("knowledge_base.read_records", wraps=read_records) as reader:
+            self.assertEqual(store.get("2024-01.txt-b").page_content, "two, corrected")
+        # only the unindexed tail of the file was parsed
+        self.assertGreater(reader.call_args.args[1], 0)
+        self.assertEqual([doc.page_content for doc in store.iter_documents()], ["one", "two, corrected", "three"])
+
+    def test_sidecar_is_ignored_after_a_rewrite_in_place(self):
+        # the same inode, but the records are no longer where the sidecar says
+        docs = load_docs_from_jsonl(self.path)
+        with open(self.path, 'w') as f:
+            for doc in [article("z", "first now", "2024-03.txt")] + docs:
+                f.write(doc.model_dump_json() + "\n")
+        store = KnowledgeBaseStore(self.path, key=get_doc_id)
+        self.assertEqual(store.get("2024-01.txt-b").page_content, "two")
+        self.assertEqual(store.get("2024-03.txt-z").page_content, "first now")
+
+    def test_index_follows_compaction(self):
+        store = KnowledgeBaseStore(self.path, key=get_doc_id, compact_ratio=0.1)
+        store.append([article("a", "one!", "2024-01.txt")])
+        reader = KnowledgeBaseStore(self.path, key=get_doc_id)
+        self.assertEqual(reader.get("2024-01.txt-a").page_content, "one!")
+        store.compact()
+        self.assertEqual(reader.get("2024-02.txt-c").page_content, "three")
+        self.assertEqual(len(reader.documents()), 3)
+
+if __name__ == "__main__":
+    unittest.main()
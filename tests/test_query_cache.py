@@ -0,0 +1,93 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from langchain_core.retrievers import BaseRetriever
+from query_cache import CachedRetriever, QueryResultCache, normalize_query
+from retrievers import Document
+
+class CountingRetriever(BaseRetriever):
+    """Returns one document echoing the query and counts the queries it actually ran."""
+    calls: list = []
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        self.calls.append(query)
+        return [Document(page_content=f"about {query}", metadata={"title": query, "source": "a.txt"})]
+
+class TestQueryResultCache(unittest.TestCase):
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  Swami   Parijnanashram\n"), "swami parijnanashram")
+
+    def test_lru_eviction_and_stats(self):
+        cache = QueryResultCache(max_entries=2)
+        doc = Document(page_content="x")
+        cache.put("a", [doc])
+        cache.put("b", [doc])
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("c", [doc])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+    def test_ttl(self):
+        cache = QueryResultCache(ttl=0.05)
+        cache.put("a", [Document(page_content="x")])
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_returns_copies(self):
+        cache = QueryResultCache()
+        cache.put("a", [Document(page_content="x")])
+        cache.get("a")[0].page_content = "edited"
+        self.assertEqual(cache.get("a")[0].page_content, "x")
+
+    def test_persists_to_disk(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "cache", "results.sqlite")
+            QueryResultCache(path=path).put("a", [Document(page_content="x", metadata={"title": "t"})])
+            docs = QueryResultCache(path=path).get("a")
+            self.assertEqual(docs, [Document(page_content="x", metadata={"title": "t"})])
+
+class TestCachedRetriever(unittest.TestCase):
+    def test_repeated_queries_hit_cache(self):
+        inner = CountingRetriever(calls=[])
+        retriever = CachedRetriever(retriever=inner, cache=QueryResultCache(), corpus_version="v1")
+        first = retriever.batch(["Seva camp", "seva  camp", "yoga"])
+        # each distinct query is retrieved once, in the spelling it was first asked in;
+        # the inner batch runs its queries concurrently, so their order is not fixed
+        self.assertCountEqual(inner.calls, ["Seva camp", "yoga"])
+        self.assertEqual(first[0], first[1])
+        second = asyncio.run(retriever.abatch(["SEVA CAMP", "bhajan"]))
+        self.assertCountEqual(inner.calls, ["Seva camp", "yoga", "bhajan"])
+        self.assertEqual(second[0], first[0])
+        self.assertEqual(retriever.invoke("yoga"), first[2])
+        self.assertEqual(len(inner.calls), 3)
+
+    def test_corpus_version_is_part_of_key(self):
+        inner = CountingRetriever(calls=[])
+        cache = QueryResultCache()
+        CachedRetriever(retriever=inner, cache=cache, corpus_version="v1").invoke("yoga")
+        CachedRetriever(retriever=inner, cache=cache, corpus_version="v2").invoke("yoga")
+        self.assertEqual(len(inner.calls), 2)
+
+    def test_abatch_keeps_sqlite_off_the_event_loop(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = QueryResultCache(path=os.path.join(tmp_dir, "results.sqlite"))
+            retriever = CachedRetriever(retriever=CountingRetriever(calls=[]), cache=cache)
+            threads = []
+            connect = cache._connect
+
+            def record_thread():
+                threads.append(threading.current_thread())
+                return connect()
+
+            cache._connect = record_thread
+            asyncio.run(retriever.abatch(["yoga"]))
+            asyncio.run(retriever.ainvoke("yoga"))
+            self.assertTrue(threads)
+            self.assertNotIn(threading.main_thread(), threads)
+
+if __name__ == "__main__":
+    unittest.main()
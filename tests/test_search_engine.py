@@ -1,7 +1,20 @@
 import unittest
-from search_engine import tokenize_query, parse_boolean_query, evaluate_query, search_knowledge_base
+from search_engine import tokenize_query, parse_boolean_query, evaluate_query, search_knowledge_base, match_query, generate_snippet_with_matches, SearchResults
+from search_index import InvertedIndex, intersect_postings, union_postings
+from query_plan import compile_query, match_plan, rank_matches, AndNode, OrNode, TermNode
+from snippets import AhoCorasick
 from retrievers import Document
 import json
+import os
+import tempfile
+import numpy as np
+
+SAMPLE_DOCS = [
+    Document(page_content="The Vishweshwara temple in Benares is a famous Hindu mandir.", metadata={"title": "Temples of India", "source": "a.txt"}),
+    Document(page_content="Swami Parijnanashram gave teachings on Sanskrit at the math.", metadata={"title": "Teachings", "source": "b.txt", "author": "Shri Anand", "published_date": "01-12-2024"}),
+    Document(page_content="A discourse by the swami on sanskar and seva.", metadata={"title": "Discourse", "source": "c.txt", "author": None, "published_date": "01-01-2025"}),
+    Document(page_content="Visweswara mandir renovation and the temple festival.", metadata={"title": "Renovation", "source": "d.txt"}),
+]
 
 class TestSearchEngine(unittest.TestCase):
     def test_tokenize_query(self):
@@ -45,6 +58,157 @@ class TestSearchEngine(unittest.TestCase):
         nested_query = {'AND': [{'OR': ['temple', 'mandir']}, {'OR': ['Vishweshwara', 'Viswesvara']}]}
         self.assertTrue(evaluate_query(nested_query, doc))
 
+    def test_parse_phrases_and_proximity(self):
+        self.assertEqual(tokenize_query('"Parijnanashram Swamiji" AND (math)'), ['"Parijnanashram Swamiji"', 'AND', '(', 'math', ')'])
+        self.assertEqual(parse_boolean_query('"Parijnanashram Swamiji" OR guru'), {'OR': [{'PHRASE': ['Parijnanashram', 'Swamiji']}, 'guru']})
+        self.assertEqual(parse_boolean_query('swami NEAR/3 "chitrapur math"'), {'NEAR/3': ['swami', {'PHRASE': ['chitrapur', 'math']}]})
+        self.assertEqual(parse_boolean_query('swami NEAR math'), {'NEAR/5': ['swami', 'math']})
+
+    def test_parse_not_and_fields(self):
+        self.assertEqual(parse_boolean_query("swami AND NOT temple"), {'AND': ['swami', {'NOT': ['temple']}]})
+        self.assertEqual(parse_boolean_query("swami NOT temple"), {'AND': ['swami', {'NOT': ['temple']}]})
+        self.assertEqual(parse_boolean_query("NOT (a OR b)"), {'NOT': [{'OR': ['a', 'b']}]})
+        self.assertEqual(parse_boolean_query("author:Shenoy AND date:2024"), {'AND': [{'FIELD': ['author', 'Shenoy']}, {'FIELD': ['date', '2024']}]})
+        self.assertEqual(parse_boolean_query('title:"chitrapur math"'), {'FIELD': ['title', {'PHRASE': ['chitrapur', 'math']}]})
+        # unknown prefixes are plain terms
+        self.assertEqual(parse_boolean_query("http://example"), "http://example")
+        # a field value is never parsed as another field
+        self.assertEqual(parse_boolean_query("title:author:x"), {'FIELD': ['title', 'author:x']})
+        for exact in (True, False):
+            self.assertEqual(len(self.run_in_knowledge_base(SearchResults, "title:author:x", exact)), 0)
+
+    def test_postings_operations(self):
+        self.assertEqual(intersect_postings([1, 3, 5, 7], [3, 4, 5]), [3, 5])
+        self.assertEqual(intersect_postings([42], list(range(100))), [42])
+        self.assertEqual(intersect_postings([], [1, 2]), [])
+        self.assertEqual(union_postings([[1, 4], [2, 4, 9], []]), [1, 2, 4, 9])
+
+    def test_token_positions_are_built_on_first_use(self):
+        index = InvertedIndex(SAMPLE_DOCS)
+        self.assertIsNone(index._positions)
+        for doc_id, doc in enumerate(SAMPLE_DOCS):
+            tokens = doc.page_content.lower().split()
+            for token in set(tokens):
+                expected = [position for position, other in enumerate(tokens) if other == token]
+                self.assertEqual(index.token_positions(token, doc_id), expected)
+        self.assertEqual(index.token_positions("qqq", 0), [])
+
+    def test_substring_lookup(self):
+        index = InvertedIndex(SAMPLE_DOCS)
+        self.assertEqual(sorted(index.tokens_containing("sans")), ["sanskar", "sanskrit"])
+        self.assertEqual(index.lookup_substring("SANS"), [1, 2])
+        self.assertEqual(index.lookup_substring("qqq"), [])
+
+    def test_compile_query_flattens_and_orders(self):
+        parsed = parse_boolean_query("(temple AND swami) AND (mandir AND temple)")
+        plan = compile_query(parsed, exact=True, index=InvertedIndex(SAMPLE_DOCS))
+        self.assertIsInstance(plan, AndNode)
+        # duplicates are dropped and the rarest term comes first
+        self.assertEqual([child.term for child in plan.children], ["mandir", "temple", "swami"])
+
+        plan = compile_query(parse_boolean_query("a OR (b OR c)"))
+        self.assertIsInstance(plan, OrNode)
+        self.assertTrue(all(isinstance(child, TermNode) for child in plan.children))
+        self.assertEqual(len(plan.children), 3)
+
+    def test_aho_corasick_finds_overlapping_matches(self):
+        automaton = AhoCorasick(["he", "she", "his", "hers"])
+        matches = sorted((start, automaton.patterns[pattern_id]) for start, _, pattern_id in automaton.finditer("ushers"))
+        self.assertEqual(matches, [(1, "she"), (2, "he"), (2, "hers")])
+
+    def test_snippets_cover_each_term(self):
+        content = "swami " + "x" * 500 + " teachings " + "y" * 500 + " swami"
+        snippet = generate_snippet_with_matches(content, ["swami", "teachings"], context_size=10, max_snippets=2)
+        parts = snippet.split(" | ")
+        self.assertEqual(len(parts), 2)
+        self.assertIn("swami", parts[0])
+        self.assertIn("teachings", parts[1])
+
+        # overlapping matches merge into a single window
+        snippet = generate_snippet_with_matches("the swami gave teachings today", ["swami", "teachings"], context_size=5)
+        self.assertEqual(snippet, "the swami gave teachings toda...")
+
+    def run_in_knowledge_base(self, search, *args, **kwargs):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "knowledge_base.jsonl"), "w") as f:
+                for doc in SAMPLE_DOCS:
+                    f.write(doc.model_dump_json() + "\n")
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                return search(*args, **kwargs)
+            finally:
+                os.chdir(cwd)
+
+    def test_search_knowledge_base(self):
+        results = self.run_in_knowledge_base(search_knowledge_base, "(temple OR mandir) AND (vishweshwara OR visweswara)")
+        self.assertIn("Temples of India (Source: a.txt)", results)
+        self.assertIn("Renovation (Source: d.txt)", results)
+        self.assertNotIn("Teachings", results)
+
+    def test_bm25_ranking(self):
+        docs = [
+            Document(page_content="temple " + "filler " * 50, metadata={"title": "long", "source": "a"}),
+            Document(page_content="temple temple temple mandir", metadata={"title": "dense", "source": "b"}),
+            Document(page_content="mandir only", metadata={"title": "other", "source": "c"}),
+            Document(page_content="temple mandir", metadata={"title": "short", "source": "d"}),
+        ]
+        index = InvertedIndex(docs)
+        plan = compile_query(parse_boolean_query("temple OR mandir"), True, index)
+        ranked = rank_matches(plan, index, match_plan(plan, index))
+        self.assertEqual(ranked[0], 1)
+        self.assertEqual(ranked[-1], 0)
+
+    def test_search_results_pagination(self):
+        results = self.run_in_knowledge_base(SearchResults, "temple OR swami")
+        self.assertEqual(len(results), 4)
+        page = results.page(offset=1, page_size=2)
+        self.assertEqual([hit.rank for hit in page], [2, 3])
+        self.assertEqual([hit.rank for hit in results], [1, 2, 3, 4])
+        self.assertEqual(results.format_page(3, 10), next(results.iter_hits(3)).format())
+
+        page = self.run_in_knowledge_base(search_knowledge_base, "temple OR swami", offset=2, page_size=1)
+        self.assertTrue(page.startswith("\n3. "))
+        self.assertNotIn("\n4. ", page)
+
+    def test_match_query_agrees_with_linear_scan(self):
+        index = InvertedIndex(SAMPLE_DOCS)
+        queries = [
+            "temple",
+            "sans",
+            "swami AND sanskrit",
+            "(viswesvara OR vishweshwara OR visweswara) AND (temple OR mandir)",
+            "((swami AND anandashram) OR (swami AND parijnanashram))",
+            "mosque OR seva",
+            "ma",
+            "eshwar AND NOTHING",
+            '"swami parijnanashram"',
+            '"the swami" OR "famous hindu"',
+            '"swami on"',
+            '"wami parij"',
+            "swami NEAR/2 sanskrit",
+            "swami NEAR/5 sanskrit",
+            '"the swami" NEAR/1 sanskar',
+            "temple NEAR mandir",
+            "NOT temple",
+            "swami AND NOT sanskrit",
+            "swami NOT sanskrit",
+            "(temple OR swami) AND NOT (mandir OR discourse)",
+            "title:teachings",
+            "title:renovation OR author:anand",
+            "date:2024",
+            "date:01-12-2024 OR date:2025",
+            'title:"temples of" AND NOT source:b',
+            "source:txt AND NOT title:teachings",
+        ]
+        for query in queries:
+            parsed = parse_boolean_query(query)
+            for exact in (True, False):
+                expected = [i for i, doc in enumerate(SAMPLE_DOCS) if evaluate_query(parsed, doc, exact)]
+                self.assertEqual(match_query(parsed, index, exact), expected, (query, exact))
+                plan = compile_query(parsed, exact, index)
+                self.assertEqual(np.flatnonzero(plan.match_mask(index)).tolist(), expected, (query, exact))
+
 if __name__ == "__main__":
     # Run the tests
     unittest.main()
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from retrievers import Document, add_to_vector_store, get_doc_id, remove_deleted_from_vector_store, sync_vector_store
+from vector_registry import IngestedRegistry, content_hash
+
+class InMemoryIndex:
+    """Stands in for a pinecone.Index: fetch by id and paginated listing, counting the calls."""
+
+    def __init__(self, ids=()):
+        self.vectors = {doc_id: SimpleNamespace(metadata={}) for doc_id in ids}
+        self.fetched = []
+        self.listed = 0
+
+    def fetch(self, ids):
+        self.fetched.append(list(ids))
+        return SimpleNamespace(vectors={doc_id: self.vectors[doc_id] for doc_id in ids if doc_id in self.vectors})
+
+    def list(self):
+        self.listed += 1
+        ids = list(self.vectors)
+        for start in range(0, len(ids), 2):
+            yield ids[start:start + 2]
+
+class InMemoryVectorStore:
+    """Stands in for PineconeVectorStore, storing the content under the "text" metadata key like it does."""
+
+    def __init__(self, index):
+        self._index = index
+        self.embedded = []
+
+    def add_documents(self, documents, ids):
+        for doc, doc_id in zip(documents, ids):
+            self.embedded.append(doc_id)
+            self._index.vectors[doc_id] = SimpleNamespace(metadata={**doc.metadata, "text": doc.page_content})
+
+    def delete(self, ids):
+        for doc_id in ids:
+            self._index.vectors.pop(doc_id, None)
+
+def article(title, content="text"):
+    return Document(page_content=content, metadata={"title": title, "source": "issue.txt"})
+
+class TestIngestedRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "registry.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_unknown_ids_are_verified_by_fetch(self):
+        index = InMemoryIndex(["issue.txt-a"])
+        registry = IngestedRegistry(self.path, index)
+        self.assertEqual(registry.existing(["issue.txt-a", "issue.txt-b"]), {"issue.txt-a"})
+        self.assertEqual(index.fetched, [["issue.txt-a", "issue.txt-b"]])
+        # ids found in the index are remembered, ids not found are checked again next time
+        registry.existing(["issue.txt-a", "issue.txt-b"])
+        self.assertEqual(index.fetched[-1], ["issue.txt-b"])
+
+    def test_rebuild_from_listing(self):
+        index = InMemoryIndex(["a", "b", "c"])
+        registry = IngestedRegistry(self.path, index)
+        registry.record({"gone": "hash"})
+        registry.rebuild()
+        self.assertEqual(len(registry), 3)
+        self.assertEqual(registry.hashes(["a", "gone"]), {"a": None})
+
+    def test_add_to_vector_store_never_lists_the_index(self):
+        index = InMemoryIndex([get_doc_id(article("a"))])
+        store = InMemoryVectorStore(index)
+        registry = IngestedRegistry(self.path, index)
+        docs = [article("a"), article("b"), article("c")]
+        add_to_vector_store(docs, vector_db=store, registry=registry)
+        self.assertEqual(index.listed, 0)
+        self.assertEqual(set(index.vectors), {get_doc_id(doc) for doc in docs})
+        self.assertEqual(registry.hashes([get_doc_id(docs[1])]), {get_doc_id(docs[1]): content_hash(docs[1])})
+
+        # a second run is answered from the registry alone
+        index.fetched.clear()
+        add_to_vector_store(docs, vector_db=store, registry=registry)
+        self.assertEqual(index.fetched, [])
+
+class TestVectorStoreDiff(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index = InMemoryIndex()
+        self.store = InMemoryVectorStore(self.index)
+        self.registry = IngestedRegistry(os.path.join(self.tmp_dir.name, "registry.sqlite"), self.index)
+        add_to_vector_store([article("a"), article("b"), article("c")], vector_db=self.store, registry=self.registry)
+        self.store.embedded.clear()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_only_changed_documents_are_re_embedded(self):
+        add_to_vector_store([article("a"), article("b", "corrected text"), article("d")], vector_db=self.store, registry=self.registry)
+        self.assertEqual(self.store.embedded, ["issue.txt-d", "issue.txt-b"])
+        self.assertEqual(self.index.vectors["issue.txt-b"].metadata["text"], "corrected text")
+
+    def test_hashes_are_recovered_from_the_index(self):
+        # a fresh registry knows nothing, yet unchanged documents are not re-embedded
+        registry = IngestedRegistry(os.path.join(self.tmp_dir.name, "fresh.sqlite"), self.index)
+        doc = Document(page_content="text", metadata={"title": "a", "source": "issue.txt", "start_page": 3})
+        add_to_vector_store([doc], vector_db=self.store, registry=self.registry)
+        self.store.embedded.clear()
+        # Pinecone hands numbers back as floats
+        self.index.vectors["issue.txt-a"].metadata["start_page"] = 3.0
+        add_to_vector_store([doc, article("b"), article("c", "new")], vector_db=self.store, registry=registry)
+        self.assertEqual(self.store.embedded, ["issue.txt-c"])
+
+    def test_deleted_documents_are_removed(self):
+        deleted = remove_deleted_from_vector_store([article("a"), article("c")], vector_db=self.store, registry=self.registry)
+        self.assertEqual(deleted, ["issue.txt-b"])
+        self.assertEqual(set(self.index.vectors), {"issue.txt-a", "issue.txt-c"})
+        self.assertEqual(self.registry.all_ids(), {"issue.txt-a", "issue.txt-c"})
+
+    def test_sync_removes_articles_dropped_from_the_ingest(self):
+        # the ingest's articles decide what stays, not the append-only knowledge base
+        deleted = sync_vector_store([article("a")], vector_db=self.store, registry=self.registry, batch_size=2, delete_missing=True)
+        self.assertEqual(deleted, ["issue.txt-b", "issue.txt-c"])
+        self.assertEqual(set(self.index.vectors), {"issue.txt-a"})
+        self.assertEqual(self.store.embedded, [])
+
+    def test_sync_only_deletes_when_asked(self):
+        self.assertEqual(sync_vector_store([article("a")], vector_db=self.store, registry=self.registry), [])
+        self.assertEqual(len(self.index.vectors), 3)
+
+    def test_deletion_is_limited_to_the_ingested_sources(self):
+        other = Document(page_content="text", metadata={"title": "a", "source": "other.txt"})
+        deleted = sync_vector_store([other], vector_db=self.store, registry=self.registry, delete_missing=True)
+        self.assertEqual(deleted, [])
+        self.assertEqual(len(self.index.vectors), 4)
+        # an empty ingestion run deletes nothing
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(remove_deleted_from_vector_store([], vector_db=self.store, registry=self.registry), [])
+        self.assertEqual(len(self.index.vectors), 4)
+
+if __name__ == "__main__":
+    unittest.main()
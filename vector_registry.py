@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from langchain_core.documents import Document
+
+# ids per Pinecone fetch request
+FETCH_BATCH_SIZE = 100
+
+def content_hash(doc: Document) -> str:
+    """sha256 of a document's content and metadata, to tell whether a stored copy is current."""
+    # Pinecone returns every number as a float
+    metadata = {
+        key: float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+        for key, value in doc.metadata.items()
+    }
+    digest = hashlib.sha256(doc.page_content.encode('utf-8'))
+    digest.update(json.dumps(metadata, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+class IngestedRegistry:
+    """
+    Local, persistent record of the documents in a vector index: doc id ->
+    content hash, kept in SQLite. Existence and change checks are answered
+    locally; ids the registry does not know are verified against the index
+    with batched fetch-by-id calls, so checking a batch costs time
+    proportional to the batch rather than to the size of the index.
+    """
+
+    def __init__(self, path: str, index, text_key: str = "text"):
+        self.path = path
+        self.index = index
+        # metadata field the vector store keeps the page content in
+        self.text_key = text_key
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS ingested (doc_id TEXT PRIMARY KEY, content_hash TEXT)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def hashes(self, doc_ids: list[str]) -> dict[str, str | None]:
+        """Content hashes of the given ids known locally; None for ids ingested with an unknown hash."""
+        found = {}
+        unique = list(dict.fromkeys(doc_ids))
+        with self._connect() as db:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = db.execute(
+                    f"SELECT doc_id, content_hash FROM ingested WHERE doc_id IN ({','.join('?' * len(batch))})", batch,
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def existing(self, doc_ids: list[str]) -> set[str]:
+        """The ids among doc_ids that are in the index."""
+        known = self.hashes(doc_ids)
+        unknown = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id not in known]
+        return set(known) | set(self._fetch_hashes(unknown))
+
+    def stored_hashes(self, doc_ids: list[str]) -> dict[str, str]:
+        """
+        Content hashes of the ids among doc_ids that are in the index.
+        Ids missing from the registry, or recorded without a hash, are fetched
+        from the index and their hashes computed from the stored metadata.
+        """
+        known = self.hashes(doc_ids)
+        unknown = [doc_id for doc_id in dict.fromkeys(doc_ids) if known.get(doc_id) is None]
+        known.update(self._fetch_hashes(unknown))
+        return {doc_id: value for doc_id, value in known.items() if value is not None}
+
+    def _fetch_hashes(self, doc_ids: list[str]) -> dict[str, str]:
+        found = {}
+        for start in range(0, len(doc_ids), FETCH_BATCH_SIZE):
+            response = self.index.fetch(ids=doc_ids[start:start + FETCH_BATCH_SIZE])
+            for doc_id, vector in response.vectors.items():
+                metadata = dict(vector.metadata or {})
+                found[doc_id] = content_hash(Document(page_content=metadata.pop(self.text_key, ''), metadata=metadata))
+        if found:
+            logging.info(f"fetched the content hashes of {len(found)} ids from the index")
+            self.record(found)
+        return found
+
+    def record(self, hashes: dict[str, str | None]) -> None:
+        """Mark documents as ingested with the given content hashes."""
+        with self._lock, self._connect() as db:
+            db.executemany("INSERT OR REPLACE INTO ingested VALUES (?, ?)", list(hashes.items()))
+
+    def forget(self, doc_ids: list[str]) -> None:
+        with self._lock, self._connect() as db:
+            db.executemany("DELETE FROM ingested WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def all_ids(self) -> set[str]:
+        with self._connect() as db:
+            return {row[0] for row in db.execute("SELECT doc_id FROM ingested")}
+
+    def __len__(self) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM ingested").fetchone()[0]
+
+    def rebuild(self) -> None:
+        """Re-synchronize with the index by listing all its ids, e.g. after the index was changed elsewhere."""
+        local = self.all_ids()
+        remote = set()
+        for page in self.index.list():
+            remote.update(page)
+        self.forget(list(local - remote))
+        self.record({doc_id: None for doc_id in remote - local})
+        logging.info(f"registry rebuilt: {len(remote)} ids, {len(remote - local)} added, {len(local - remote)} removed")